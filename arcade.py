@@ -0,0 +1,141 @@
+import pygame
+from pygame.locals import *
+import pong
+import snake
+import tetris
+from hid_input import HIDReader, open_device
+import framebuffer
+from scenes import SceneManager
+
+# Cabinet launcher - one process for all the games. pygame, the display and
+# the HID controllers are set up once here, the menu picks a game and runs
+# its game_loop on the shared display, and ESC in a game comes back to the
+# menu. Closing the window (or ESC on the menu) quits.
+#
+# A game module has game_loop(display, controller), which runs until the
+# game is left, stop(quit=False) to end it from outside, and quit_requested
+# set when the window was closed. Games with a controller give its
+# CONTROLLER_ID and decode_report, so the menu can be driven with it too.
+
+GAMES = [("Pong", pong), ("Snake", snake), ("Tetris", tetris)]
+
+BLACK = (25, 0, 50)
+WHITE = (255, 255, 255)
+GRAY = (120, 120, 120)
+
+MENU = 0
+
+scene_manager = SceneManager(paced=True)
+screen = None
+font_large = None
+controllers = {}
+readers = []
+held = {}
+selected = 0
+shown = None
+chosen = None
+quit_requested = False
+
+
+def open_controllers():
+    for name, game in GAMES:
+        if hasattr(game, "CONTROLLER_ID"):
+            controllers[name] = open_device(*game.CONTROLLER_ID)
+
+
+def read_menu_input(now):
+    global selected, chosen, quit_requested
+    keys = []
+    for event in pygame.event.get():
+        if event.type == QUIT:
+            quit_requested = True
+            scene_manager.stop()
+        elif event.type == KEYDOWN:
+            keys.append(event.key)
+    for game, reader in readers:
+        keys.extend(controller_keys(game, reader))
+
+    for key in keys:
+        if key == K_ESCAPE:
+            quit_requested = True
+            scene_manager.stop()
+        elif key in (K_UP, K_LEFT):
+            selected = (selected - 1) % len(GAMES)
+        elif key in (K_DOWN, K_RIGHT):
+            selected = (selected + 1) % len(GAMES)
+        elif key in (K_SPACE, K_RETURN):
+            chosen = GAMES[selected]
+            scene_manager.stop()
+
+
+def controller_keys(game, reader):
+    # A controller that repeats its report while a button is held also
+    # reports RELEASE when let go - as in that game, only a change counts
+    # as a press
+    keys = []
+    for timestamp, key in reader.drain():
+        if not hasattr(game, "RELEASE"):
+            keys.append(key)
+        elif key == game.RELEASE:
+            held[reader] = None
+        elif key != held.get(reader):
+            held[reader] = key
+            keys.append(key)
+    return keys
+
+
+def menu_screen(elapsed):
+    global shown
+    if scene_manager.scene_frames and shown == selected:
+        return
+    shown = selected
+    screen.fill(BLACK)
+    for i, (name, _) in enumerate(GAMES):
+        text = font_large.render(name, True, WHITE if i == selected else GRAY)
+        screen.blit(text, text.get_rect(center=(screen.get_width() // 2, 200 + i * 100)))
+    scene_manager.drawn = True
+
+
+def menu():
+    # The chosen (name, game), or None to quit
+    global chosen
+    chosen = None
+    pygame.display.set_caption("Arcade")
+    for name, game in GAMES:
+        if controllers.get(name):
+            reader = HIDReader(controllers[name], game.decode_report)
+            reader.start()
+            readers.append((game, reader))
+    scene_manager.add(MENU, menu_screen)
+    scene_manager.run(MENU, frame=read_menu_input)
+    while readers:
+        readers.pop()[1].stop()
+    held.clear()
+    return chosen
+
+
+def main():
+    global screen, font_large
+    pygame.init()
+    screen = framebuffer.open_display((800, 600), pygame.FULLSCREEN | pygame.SCALED)
+    pygame.mouse.set_visible(False)
+    font_large = pygame.font.Font(None, 96)
+    open_controllers()
+
+    while not quit_requested:
+        choice = menu()
+        if choice is None:
+            break
+        name, game = choice
+        pygame.display.set_caption(name)
+        game.game_loop(screen, controllers.get(name))
+        if game.quit_requested:
+            break
+
+    pygame.mouse.set_visible(True)
+    framebuffer.close_display()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# stdout is only the JSON
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+import numpy as np
+import pygame
+import replay
+from profiler import FrameProfiler
+
+# Headless benchmarks for the three games. Each game's real game_loop runs
+# on SDL's dummy display from a scripted input recording - a fixed 60 fps
+# frame clock, seeded RNG and generated key presses, bike edges and held
+# keys - replayed as fast as possible. Every game is run twice: once for
+# frame and phase timings, then again under tracemalloc for per-frame
+# allocations, which would otherwise skew the timings.
+#
+#   python bench.py                       all games, JSON on stdout
+#   python bench.py tetris --frames 20000
+#   python bench.py -o new.json --compare old.json
+#
+# Allocation figures: peak_kb is how far traced memory rose above the frame's
+# starting point (transient allocations), net_blocks the change in allocated
+# blocks over the frame, gc_gen0 the young generation collections per 1000
+# frames. The allocation pass does no phase timing, its readings go into
+# preallocated arrays and the cost of an empty frame is measured and taken
+# off, so the figures are the game's own.
+
+FRAME_TIME = 1 / 60
+SEED = 1234
+
+
+class AllocProfiler(FrameProfiler):
+    # Stands in for the scene manager's profiler on the allocation pass
+    def __init__(self, capacity):
+        super().__init__()
+        self.peaks = np.zeros(capacity, dtype=np.int64)
+        self.blocks = np.zeros(capacity, dtype=np.int64)
+        self.start_memory = 0
+        self.start_blocks = 0
+        # Young collections inside frames, loading the recording doesn't count
+        self.collections = 0
+        self.in_frame = False
+
+    def count_collection(self, phase, info):
+        if self.in_frame and phase == "start" and info["generation"] == 0:
+            self.collections += 1
+
+    def start_frame(self):
+        self.in_frame = True
+        tracemalloc.reset_peak()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.start_blocks = sys.getallocatedblocks()
+
+    def mark(self, phase):
+        pass
+
+    def end_frame(self):
+        blocks = sys.getallocatedblocks() - self.start_blocks
+        peak = tracemalloc.get_traced_memory()[1] - self.start_memory
+        self.in_frame = False
+        if self.frames < len(self.peaks):
+            self.peaks[self.frames] = peak
+            self.blocks[self.frames] = blocks
+            self.frames += 1
+
+    def baseline(self, frames=1000):
+        # Mean (peak, blocks) of a frame with nothing in it, then start over
+        for _ in range(frames):
+            self.start_frame()
+            self.end_frame()
+        ran = self.frames
+        result = self.peaks[:ran].mean(), self.blocks[:ran].mean()
+        self.frames = 0
+        self.collections = 0
+        return result
+
+
+def script_pong(frames, rng):
+    # Both players hold ready and sweep their paddles with the keys, and
+    # pedal at about 90 rpm, changing direction every 2 s
+    script = []
+    for i in range(frames):
+        now = i * FRAME_TIME
+        frame = {"now": now, "sensor": []}
+        if i % 40 == 0:
+            p1 = pygame.K_w if (i // 40) % 2 else pygame.K_s
+            p2 = pygame.K_UP if (i // 60) % 2 else pygame.K_DOWN
+            frame["keys"] = {pygame.K_1, pygame.K_2, p1, p2}
+        if i % 40 == 0:
+            first, second = ("A", "B") if int(now / 2) % 2 else ("B", "A")
+            for player in ("P1", "P2"):
+                frame["sensor"].append((now, player, first))
+        elif i % 40 == 6:
+            first, second = ("A", "B") if int(now / 2) % 2 else ("B", "A")
+            for player in ("P1", "P2"):
+                frame["sensor"].append((now, player, second))
+        script.append(frame)
+    return script
+
+
+def script_snake(frames, rng):
+    # Start whenever on the ready screen and go round in squares, turning
+    # every four moves, so the snake eats now and then and eventually dies
+    turns = [pygame.K_RIGHT, pygame.K_DOWN, pygame.K_LEFT, pygame.K_UP]
+    script = []
+    for i in range(frames):
+        frame = {"now": i * FRAME_TIME, "events": []}
+        if i % 60 == 0:
+            frame["events"].append((pygame.KEYDOWN, pygame.K_SPACE))
+        if i % 60 == 30:
+            frame["events"].append((pygame.KEYDOWN, turns[(i // 60) % 4]))
+        script.append(frame)
+    return script
+
+
+def script_tetris(frames, rng):
+    # Start whenever on the ready screen, then random moves, rotations and
+    # drops about six times a second
+    moves = [pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN]
+    script = []
+    for i in range(frames):
+        frame = {"now": i * FRAME_TIME, "events": []}
+        if i % 60 == 0:
+            frame["events"].append((pygame.KEYDOWN, pygame.K_SPACE))
+        if rng.random() < 0.1:
+            frame["events"].append((pygame.KEYDOWN, rng.choice(moves)))
+        script.append(frame)
+    return script
+
+
+SCRIPTS = {"pong": script_pong, "snake": script_snake, "tetris": script_tetris}
+
+
+def run_game(name, frames, display, allocations=False):
+    game = __import__(name)
+    path = os.path.join(tempfile.gettempdir(), f"bench_{name}_{os.getpid()}.rec")
+    replay.write_recording(path, name, SEED, SCRIPTS[name](frames, random.Random(SEED)))
+    replay.RECORD_FILE = None
+    replay.REPLAY_FILE = path
+    replay.REPLAY_FAST = True
+
+    if allocations:
+        profiler = AllocProfiler(frames + 1)
+        tracemalloc.start()
+        empty_peak, empty_blocks = profiler.baseline()
+        gc.callbacks.append(profiler.count_collection)
+    else:
+        profiler = FrameProfiler(enabled=True, window=frames)
+    game.scene_manager.profiler = profiler
+    gc.collect()
+    start = time.perf_counter()
+    try:
+        game.game_loop(display)
+    finally:
+        seconds = time.perf_counter() - start
+        if allocations:
+            tracemalloc.stop()
+            gc.callbacks.remove(profiler.count_collection)
+        os.remove(path)
+    ran = profiler.frames
+
+    if not allocations:
+        return {
+            "frames": ran,
+            "seconds": round(seconds, 4),
+            "fps": round(ran / seconds, 1),
+            "phases": {phase: {key: round(value, 4) for key, value in stats.items()}
+                       for phase, stats in profiler.stats().items()},
+        }
+    peaks = np.sort(profiler.peaks[:ran]) - empty_peak
+    blocks = profiler.blocks[:ran] - empty_blocks
+    return {
+        "peak_kb_mean": round(float(peaks.mean()) / 1024, 2),
+        "peak_kb_p99": round(float(peaks[int(ran * 0.99)]) / 1024, 2),
+        "net_blocks_per_frame": round(float(blocks.mean()), 3),
+        "gc_gen0": round(profiler.collections * 1000 / ran, 2),
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    # Relative change per game of fps and the sim phase mean
+    for name, result in results["games"].items():
+        old = baseline.get("games", {}).get(name)
+        if not old:
+            continue
+        lines = [f"{name}: fps {old['fps']} -> {result['fps']} ({(result['fps'] / old['fps'] - 1) * 100:+.1f}%)"]
+        old_sim = old["phases"].get("sim", {}).get("mean_ms")
+        new_sim = result["phases"].get("sim", {}).get("mean_ms")
+        if old_sim and new_sim:
+            lines.append(f"sim {old_sim:.4f} -> {new_sim:.4f} ms ({(new_sim / old_sim - 1) * 100:+.1f}%)")
+        print(", ".join(lines), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless game loop benchmarks")
+    parser.add_argument("games", nargs="*", help="games to run, default all: " + ", ".join(SCRIPTS))
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--no-alloc", action="store_true", help="skip the allocation pass")
+    parser.add_argument("-o", "--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON output to compare against")
+    args = parser.parse_args()
+    for name in args.games:
+        if name not in SCRIPTS:
+            parser.error(f"unknown game {name}")
+
+    pygame.init()
+    display = pygame.display.set_mode((800, 600))
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "frames": args.frames,
+        "games": {},
+    }
+    for name in args.games or SCRIPTS:
+        result = run_game(name, args.frames, display)
+        if not args.no_alloc:
+            result["allocations"] = run_game(name, args.frames, display, allocations=True)
+        results["games"][name] = result
+    pygame.quit()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import heapq
+import random
+import threading
+import time
+
+# Input backends for the bike hall sensors and start buttons. A backend is
+# started with two callbacks: on_sensor(player, sensor) for every sensor edge
+# ("P1"/"P2", "A"/"B") and on_start(player) for a start button press.
+#
+#   GPIOBackend      - the real RPi.GPIO pins
+#   SimulatedBackend - riders pedalling at a set cadence with jitter, for
+#                      running and soak testing off the Pi
+#   KeyboardBackend  - no bike input at all, the keyboard controls still work
+
+
+class KeyboardBackend:
+    def start(self, on_sensor, on_start):
+        pass
+
+    def stop(self):
+        pass
+
+
+class GPIOBackend:
+    def __init__(self, sensor_pins, start_pins, bouncetime=25, start_bouncetime=300):
+        # sensor_pins: {(player, sensor): pin}, start_pins: {player: pin}
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.sensor_pins = sensor_pins
+        self.start_pins = start_pins
+        self.bouncetime = bouncetime
+        self.start_bouncetime = start_bouncetime
+
+    def start(self, on_sensor, on_start):
+        GPIO = self.GPIO
+        GPIO.setmode(GPIO.BCM)
+        for (player, sensor), pin in self.sensor_pins.items():
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(pin, GPIO.FALLING, bouncetime=self.bouncetime,
+                                  callback=lambda channel, p=player, s=sensor: on_sensor(p, s))
+        for player, pin in self.start_pins.items():
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(pin, GPIO.FALLING, bouncetime=self.start_bouncetime,
+                                  callback=lambda channel, p=player: on_start(p))
+
+    def stop(self):
+        self.GPIO.cleanup()
+
+
+class SimulatedBackend:
+    def __init__(self, players=("P1", "P2"), cadence=90, jitter=0.1, pair_fraction=0.15,
+                 sweep_time=2.0, start_interval=5.0, seed=None):
+        # cadence in rpm (one A/B pair per revolution), jitter as a fraction of
+        # the period, pair_fraction is the A->B gap as a fraction of the period.
+        # Riders swap direction every sweep_time seconds so the paddles sweep
+        # the screen, and both start buttons are pressed every start_interval.
+        self.players = players
+        self.cadence = cadence
+        self.jitter = jitter
+        self.pair_fraction = pair_fraction
+        self.sweep_time = sweep_time
+        self.start_interval = start_interval
+        self.random = random.Random(seed)
+        self.thread = None
+        self.stopping = threading.Event()
+        self.edges = 0
+
+    def start(self, on_sensor, on_start):
+        self.on_sensor = on_sensor
+        self.on_start = on_start
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="sim-bikes", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def period(self):
+        period = 60.0 / self.cadence
+        return period * (1 + self.random.uniform(-self.jitter, self.jitter))
+
+    def run(self):
+        start = time.perf_counter()
+        # (due time, kind, player, sensor) - kind is "pair", "edge" or "start"
+        queue = [(start + self.random.uniform(0, self.period()), "pair", player, None) for player in self.players]
+        queue.append((start + self.start_interval, "start", None, None))
+        heapq.heapify(queue)
+
+        while not self.stopping.is_set():
+            due, kind, player, sensor = heapq.heappop(queue)
+            delay = due - time.perf_counter()
+            if delay > 0 and self.stopping.wait(delay):
+                break
+
+            if kind == "start":
+                for each in self.players:
+                    self.on_start(each)
+                heapq.heappush(queue, (due + self.start_interval, "start", None, None))
+            elif kind == "edge":
+                self.on_sensor(player, sensor)
+                self.edges += 1
+            else:
+                # B then A moves the paddle down, A then B moves it up
+                period = self.period()
+                down = int((due - start) / self.sweep_time) % 2 == 0
+                first, second = ("B", "A") if down else ("A", "B")
+                self.on_sensor(player, first)
+                self.edges += 1
+                heapq.heappush(queue, (due + period * self.pair_fraction, "edge", player, second))
+                heapq.heappush(queue, (due + period, "pair", player, None))
@@ -0,0 +1,197 @@
+import mmap
+import os
+import stat
+import struct
+import pygame
+
+# Output straight to a Linux framebuffer, e.g. /dev/fb0 on the Pi driving the
+# LED panel, instead of a fullscreen SDL display with its compositor and
+# scaler. The games draw into an offscreen surface that is already in the
+# framebuffer's pixel format, so SDL converts every blit as it goes, and
+# presenting a frame is a copy of the changed rows into the back page of the
+# memory mapped framebuffer, then a pan to show it. A regular file works as
+# a stand-in for the device, its pages laid end to end.
+#
+# The games keep their 800x600 layout. When the panel is another size each
+# frame is scaled to it nearest-neighbour in one call, which keeps the
+# blocky look, and presented whole.
+#
+# fcntl and NumPy are only imported once a framebuffer is opened, the games
+# import this module either way.
+#
+# Set FRAMEBUFFER to the device or file to use it, FRAMEBUFFER_SIZE (e.g.
+# 800x600, default the game's size) and FRAMEBUFFER_FORMAT for a file. SDL
+# then runs on the dummy video driver, so input comes from the controllers
+# and bikes only.
+
+FRAMEBUFFER = os.environ.get("FRAMEBUFFER")
+FRAMEBUFFER_SIZE = os.environ.get("FRAMEBUFFER_SIZE")
+FRAMEBUFFER_FORMAT = os.environ.get("FRAMEBUFFER_FORMAT", "RGB565")
+BUFFERS = 2
+
+if FRAMEBUFFER:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+# (bits per pixel, red, green and blue as (offset, length)), like the
+# kernel's fb_var_screeninfo
+FORMATS = {
+    "RGB565": (16, (11, 5), (5, 6), (0, 5)),
+    "RGB888": (24, (16, 8), (8, 8), (0, 8)),
+    "XRGB8888": (32, (16, 8), (8, 8), (0, 8)),
+}
+
+# linux/fb.h
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+FBIOPAN_DISPLAY = 0x4606
+VAR_SCREENINFO = struct.Struct("@40I")
+FIX_SCREENINFO = struct.Struct("@16sL4I3HIL2IH2H")
+
+
+class Framebuffer:
+    def __init__(self, path, size=None, pixel_format=FRAMEBUFFER_FORMAT, buffers=BUFFERS):
+        # size is the games' surface size, the panel's own size comes from
+        # the device, or is size for a file
+        self.path = path
+        self.size = size
+        self.pixel_format = pixel_format
+        self.buffers = buffers
+        self.file = None
+        self.map = None
+        self.var_info = None
+        self.device = False
+        self.pages = 1
+        self.back = 0
+        self.front = 0
+        self.missing = []
+        self.surface = None
+        self.panel_surface = None
+
+    def open(self, panel_size=None):
+        import fcntl
+        import numpy as np
+        self.file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        self.device = stat.S_ISCHR(os.fstat(self.file.fileno()).st_mode)
+        if self.device:
+            var_info = bytearray(VAR_SCREENINFO.size)
+            fcntl.ioctl(self.file, FBIOGET_VSCREENINFO, var_info)
+            fix_info = bytearray(max(FIX_SCREENINFO.size, 80))
+            fcntl.ioctl(self.file, FBIOGET_FSCREENINFO, fix_info)
+            self.var_info = list(VAR_SCREENINFO.unpack(var_info))
+            width, height, _, virtual_height = self.var_info[:4]
+            bits = self.var_info[6]
+            red, green, blue = [tuple(self.var_info[i:i + 2]) for i in (8, 11, 14)]
+            self.line_length = FIX_SCREENINFO.unpack_from(fix_info)[9]
+            # Panning needs a virtual height of two screens, fbset -vyres
+            self.pages = max(1, min(self.buffers, virtual_height // height))
+        else:
+            width, height = panel_size or self.size
+            bits, red, green, blue = FORMATS[self.pixel_format]
+            self.line_length = width * bits // 8
+            self.pages = max(1, self.buffers)
+        self.panel_size = (width, height)
+        self.bytes_per_pixel = bits // 8
+        self.page_bytes = self.line_length * height
+
+        length = self.page_bytes * self.pages
+        if not self.device and os.fstat(self.file.fileno()).st_size < length:
+            self.file.truncate(length)
+        self.map = mmap.mmap(self.file.fileno(), length)
+        self.page_views = [np.frombuffer(self.map, np.uint8, self.page_bytes, page * self.page_bytes)
+                           .reshape(height, self.line_length) for page in range(self.pages)]
+
+        masks = [((1 << bits_used) - 1) << shift for shift, bits_used in (red, green, blue)] + [0]
+        self.panel_surface = pygame.Surface(self.panel_size, 0, bits, masks)
+        size = self.size or self.panel_size
+        self.surface = self.panel_surface if size == self.panel_size else pygame.Surface(size, 0, bits, masks)
+        # Per page, the rects it is behind on, None when it needs everything
+        self.missing = [None] * self.pages
+        self.front = 0
+        self.back = 1 % self.pages
+        return self.surface
+
+    def close(self):
+        if self.map:
+            self.page_views = []
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def present(self, rects=None):
+        # rects are the changed areas, None for the whole frame
+        import numpy as np
+        if self.surface is not self.panel_surface:
+            pygame.transform.scale(self.surface, self.panel_size, self.panel_surface)
+            rects = None
+        # The back page was last written pages - 1 frames ago, so it takes
+        # the changes of those frames as well as this one's
+        rects = None if rects is None else list(rects)
+        for page, missing in enumerate(self.missing):
+            if missing is not None:
+                self.missing[page] = None if rects is None else missing + rects
+        copy = self.missing[self.back]
+        self.missing[self.back] = []
+
+        bpp = self.bytes_per_pixel
+        width, height = self.panel_size
+        page = self.page_views[self.back]
+        pixels = self.panel_surface.get_buffer()
+        source = np.frombuffer(pixels, np.uint8).reshape(height, self.panel_surface.get_pitch())
+        if copy is None:
+            page[:, :width * bpp] = source[:, :width * bpp]
+        else:
+            bounds = self.panel_surface.get_rect()
+            for rect in copy:
+                rect = bounds.clip(rect)
+                page[rect.top:rect.bottom, rect.left * bpp:rect.right * bpp] = \
+                    source[rect.top:rect.bottom, rect.left * bpp:rect.right * bpp]
+        del source, pixels
+        self.flip()
+
+    def flip(self):
+        # Show the back page
+        if self.device and self.pages > 1:
+            import fcntl
+            self.var_info[5] = self.back * self.panel_size[1]
+            fcntl.ioctl(self.file, FBIOPAN_DISPLAY, VAR_SCREENINFO.pack(*self.var_info))
+        self.front = self.back
+        self.back = (self.back + 1) % self.pages
+
+
+# The framebuffer the games present to, while one is open
+output = None
+
+
+def open_display(size, flags=0):
+    # The surface to draw on - the SDL display, or with FRAMEBUFFER set an
+    # offscreen surface presented to the framebuffer
+    global output
+    if not FRAMEBUFFER:
+        return pygame.display.set_mode(size, flags)
+    # SDL still wants a video mode for its event queue
+    pygame.display.set_mode((1, 1))
+    panel_size = tuple(int(n) for n in FRAMEBUFFER_SIZE.split("x")) if FRAMEBUFFER_SIZE else None
+    output = Framebuffer(FRAMEBUFFER, size)
+    return output.open(panel_size)
+
+
+def close_display():
+    global output
+    if output:
+        output.close()
+        output = None
+
+
+def present(rects=None):
+    if output:
+        output.present(rects)
+    elif rects is None:
+        pygame.display.flip()
+    else:
+        pygame.display.update(rects)
+
+
+def get_surface():
+    return output.surface if output else pygame.display.get_surface()
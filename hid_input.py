@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import deque
+import pygame
+
+# Background reader for the HID game controllers. A thread does blocking
+# reads with a timeout, decodes each report into a key and appends
+# (timestamp, key) to a bounded queue - when the queue is full the event is
+# dropped and counted. The game drains the queue once per frame, so no
+# report is lost between frames however fast the inputs come.
+#
+# Every decoded event also posts WAKE so a paced scene manager sleeping in
+# pygame.event.wait() wakes up for it.
+
+WAKE = pygame.event.custom_type()
+
+
+def open_device(vendor_id, product_id):
+    # An open hid.device, or None when it isn't plugged in
+    import hid  # hidapi
+    try:
+        device = hid.device()
+        device.open(vendor_id, product_id)
+        return device
+    except Exception as e:
+        print("Controller not connected.", e)
+        return None
+
+
+class HIDReader:
+    def __init__(self, device, decode, size=64, timeout=100, capacity=64):
+        # decode(report) returns a key or None, timeout is the read timeout
+        # in ms, how long stop() can take at most
+        self.device = device
+        self.decode = decode
+        self.size = size
+        self.timeout = timeout
+        self.capacity = capacity
+        self.events = deque()
+        self.dropped = 0
+        self.connected = True
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopping = False
+        self.device.set_nonblocking(False)
+        self.thread = threading.Thread(target=self.run, name="hid-reader", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stopping = True
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stopping:
+            try:
+                data = self.device.read(self.size, self.timeout)
+            except (OSError, ValueError) as e:
+                print("Controller read error, disabling controller input.", e)
+                self.connected = False
+                return
+            if not data:
+                continue
+            key = self.decode(data)
+            if key is None:
+                continue
+            if len(self.events) >= self.capacity:
+                self.dropped += 1
+                continue
+            self.events.append((time.perf_counter(), key))
+            try:
+                pygame.event.post(pygame.event.Event(WAKE))
+            except pygame.error:
+                pass
+
+    def drain(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
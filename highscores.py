@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# High score table for one game, kept in an SQLite database in WAL mode that
+# all the games share. The game's top scores are loaded once at start and
+# kept in memory, so drawing them is just reading a list. add() updates that
+# list and queues the row - a background thread writes queued rows out in
+# one transaction, so a game over never waits on the disk. When the queue is
+# full the row is dropped and counted, like the event log.
+
+
+class HighScores:
+    def __init__(self, path, game, limit=10, capacity=256):
+        self.path = path
+        self.game = game
+        self.limit = limit
+        self.capacity = capacity
+        self.table = []
+        self.pending = deque()
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS scores "
+                           "(game TEXT NOT NULL, score INTEGER NOT NULL, detail TEXT, recorded REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS scores_rank ON scores (game, score DESC, recorded)")
+        return connection
+
+    def load(self):
+        try:
+            connection = self.connect()
+            try:
+                rows = connection.execute(
+                    "SELECT score, detail, recorded FROM scores WHERE game = ? "
+                    "ORDER BY score DESC, recorded LIMIT ?", (self.game, self.limit)).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            print("High scores not available.", e)
+            rows = []
+        self.table = rows
+
+    def start(self):
+        # Loads the table before the game starts, the only read from disk
+        if self.thread:
+            return
+        self.load()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="high-scores", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+
+    def top(self, count=None):
+        # [(score, detail, recorded)], best first - earlier wins a tie
+        return self.table if count is None else self.table[:count]
+
+    def add(self, score, detail=""):
+        # Rank of the score in the table from 1, or None if it didn't make it
+        row = (score, detail, time.time())
+        rank = next((i for i, (best, _, _) in enumerate(self.table) if score > best), len(self.table))
+        if rank < self.limit:
+            self.table = self.table[:rank] + [row] + self.table[rank:self.limit - 1]
+        if len(self.pending) >= self.capacity:
+            self.dropped += 1
+        else:
+            self.pending.append(row)
+            self.wake.set()
+        return rank + 1 if rank < self.limit else None
+
+    def run(self):
+        try:
+            connection = self.connect()
+        except sqlite3.Error as e:
+            print("High scores will not be saved.", e)
+            return
+        try:
+            while not self.stopping:
+                self.wake.wait()
+                self.wake.clear()
+                self.flush(connection)
+            self.flush(connection)
+        finally:
+            connection.close()
+
+    def flush(self, connection):
+        rows = []
+        while self.pending:
+            score, detail, recorded = self.pending.popleft()
+            rows.append((self.game, score, detail, recorded))
+        if not rows:
+            return
+        try:
+            with connection:
+                connection.executemany("INSERT INTO scores (game, score, detail, recorded) VALUES (?, ?, ?, ?)", rows)
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            print("High score write failed.", e)
@@ -0,0 +1,124 @@
+import numpy as np
+import pygame
+
+# Many balls at once for pong's chaos mode. Positions and directions live in
+# (n, 2) NumPy arrays and every physics step moves, bounces and scores all of
+# the balls together - the same swept collisions as the single ball, each
+# round of bounces done for every ball at once. Balls pass through each
+# other. They are drawn by blitting one cached sprite, so the cost per ball
+# is a blit rather than a Python step.
+
+# Launch angles from the horizontal, radians
+MAX_ANGLE = 0.8
+
+
+def sweep_rects(pos, delta, left, top, right, bottom):
+    # For each ball the first time t in [0, 1] the point pos + t * delta
+    # enters the rect, inf for a miss, and the axis it entered through.
+    # Starting inside is not a hit, as in pong.sweep_rect.
+    count = len(pos)
+    t_enter = np.full(count, -np.inf)
+    t_exit = np.full(count, np.inf)
+    axis = np.full(count, -1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for column, low, high in ((0, left, right), (1, top, bottom)):
+            p = pos[:, column]
+            d = delta[:, column]
+            t0 = (low - p) / d
+            t1 = (high - p) / d
+            near = np.minimum(t0, t1)
+            far = np.maximum(t0, t1)
+            # Not moving on this axis - a miss unless already between the sides
+            still = d == 0
+            near[still] = -np.inf
+            far[still] = np.where((p[still] <= low) | (p[still] >= high), -np.inf, np.inf)
+            later = near > t_enter
+            t_enter = np.where(later, near, t_enter)
+            axis = np.where(later, column, axis)
+            t_exit = np.minimum(t_exit, far)
+    hit = (axis >= 0) & (t_enter >= 0) & (t_enter <= 1) & (t_enter < t_exit)
+    return np.where(hit, t_enter, np.inf), axis
+
+
+class Balls:
+    def __init__(self, count, width, height, size, max_bounces=4):
+        self.count = count
+        self.width = width
+        self.height = height
+        self.size = size
+        self.max_bounces = max_bounces
+        self.pos = np.zeros((count, 2))
+        self.prev_pos = np.zeros((count, 2))
+        self.dir = np.zeros((count, 2))
+        self.sprite = None
+
+    def launch(self, balls, sides, speed, rng):
+        # Balls from the centre line towards the side given (1 right, -1
+        # left), each at its own angle and height so they don't all arrive
+        # together - at the single ball's speed in the steepest direction
+        count = len(balls)
+        angles = np.array([rng.uniform(-MAX_ANGLE, MAX_ANGLE) for _ in range(count)])
+        heights = np.array([rng.uniform(0, self.height - self.size) for _ in range(count)])
+        self.pos[balls, 0] = (self.width - self.size) / 2
+        self.pos[balls, 1] = heights
+        self.prev_pos[balls] = self.pos[balls]
+        self.dir[balls, 0] = sides * speed[0] * np.sqrt(2) * np.cos(angles)
+        self.dir[balls, 1] = speed[1] * np.sqrt(2) * np.sin(angles)
+
+    def reset(self, speed, rng):
+        # Alternately left and right
+        sides = np.where(np.arange(self.count) % 2, -1, 1)
+        self.launch(np.arange(self.count), sides, speed, rng)
+
+    def step(self, dt, paddles, speed, rng):
+        # paddles is [(x, y, width, height)], returns the points scored by
+        # the left and right player this step
+        pos = self.pos
+        self.prev_pos[:] = pos
+        scale = dt * 60
+        remaining = np.ones(self.count)
+        low_wall = self.height - self.size
+
+        for _ in range(self.max_bounces):
+            delta = self.dir * (scale * remaining)[:, None]
+            dy = delta[:, 1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.where(dy < 0, -pos[:, 1] / dy, np.where(dy > 0, (low_wall - pos[:, 1]) / dy, np.inf))
+            t = np.maximum(t, 0.0)
+            t[t > 1] = np.inf
+            axis = np.ones(self.count, dtype=int)
+
+            # Paddles grown by the ball size so the balls can be swept as points
+            for x, y, width, height in paddles:
+                paddle_t, paddle_axis = sweep_rects(pos, delta, x - self.size, y - self.size, x + width, y + height)
+                closer = paddle_t < t
+                t = np.where(closer, paddle_t, t)
+                axis = np.where(closer, paddle_axis, axis)
+
+            hit = np.isfinite(t)
+            pos += delta * np.where(hit, t, 1.0)[:, None]
+            if not hit.any():
+                break
+            balls = np.nonzero(hit)[0]
+            self.dir[balls, axis[balls]] *= -1
+            remaining = np.where(hit, remaining * (1 - t), 0.0)
+
+        left = np.nonzero(pos[:, 0] <= 0)[0]
+        right = np.nonzero(pos[:, 0] >= self.width - self.size)[0]
+        # Scored balls go back to the middle heading the other way
+        if len(left) or len(right):
+            scored = np.concatenate((left, right))
+            self.launch(scored, -np.sign(self.dir[scored, 0]), speed, rng)
+        return len(right), len(left)
+
+    def draw(self, surface, color, alpha):
+        # Rects of the balls, interpolated between the last two steps
+        if self.sprite is None:
+            self.sprite = pygame.Surface((self.size, self.size))
+            self.sprite.fill((0, 0, 0))
+            pygame.draw.ellipse(self.sprite, color, self.sprite.get_rect())
+            self.sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            self.sprite = self.sprite.convert(surface)
+        drawn = self.prev_pos + (self.pos - self.prev_pos) * alpha
+        sprite = self.sprite
+        return surface.blits([(sprite, position) for position in drawn.astype(int).tolist()])
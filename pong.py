@@ -1,14 +1,29 @@
+import os
 import pygame
+import math
+import random
 import time
-import RPi.GPIO as GPIO
+from collections import OrderedDict, deque
+import bike_input
+from scenes import SceneManager
+from profiler import FrameProfiler
+import telemetry
+import spectator
+from highscores import HighScores
+import framebuffer
+import multiball
+import replay
+from replay import session
 
 # Main config
 WIN_SCORE = 5
 BALL_SPEED = 3.5 # Initial value - override with keys 3/4/5/6
 
+# Chaos mode for crowd events - C on the ready screen toggles it. Dozens of
+# balls are in play at once and it's first to CHAOS_WIN_SCORE.
+CHAOS_BALLS = int(os.environ.get("PONG_CHAOS_BALLS", "50"))
+CHAOS_WIN_SCORE = 100
 
-# Initialize pygame
-pygame.init()
 
 # Screen dimensions
 SCREEN_WIDTH = 800
@@ -25,6 +40,15 @@ PADDLE_WIDTH = 20
 PADDLE_HEIGHT = 100
 PADDLE_SPEED = 10
 
+# Bike decoder settings - a sensor A/B pair is one step of PADDLE_STEP pixels,
+# paddle speed follows the rider's step rate between pairs
+PADDLE_STEP = 3 * PADDLE_SPEED
+PAIRS_PER_REV = 1       # magnet passes per crank revolution
+PAIR_WINDOW = 0.10      # max A/B gap for the first pair after idle
+IDLE_TIMEOUT = 1.5      # no edges for this long = rider stopped
+EDGE_HISTORY = 8
+DECODER_SMOOTHING = 0.5
+
 # GPIO Pins for Hall Sensors and buttons
 P1_SENSOR_A = 23
 P1_SENSOR_B = 24
@@ -33,77 +57,214 @@ P2_SENSOR_B = 27
 P1_START = 2
 P2_START = 3
 
-# Initialize GPIO
 BOUNCE = 25
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(P1_SENSOR_A, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(P1_SENSOR_B, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(P2_SENSOR_A, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(P2_SENSOR_B, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(P1_START, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(P2_START, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+# Bike input - "gpio" on the Pi, "sim" for simulated riders, "keyboard" for
+# keys only. Override with PONG_INPUT to run off the Pi.
+INPUT_BACKEND = os.environ.get("PONG_INPUT", "gpio")
+SIM_CADENCE = 90
+SIM_JITTER = 0.1
+
+def create_input_backend(name):
+    if name == "sim":
+        return bike_input.SimulatedBackend(cadence=SIM_CADENCE, jitter=SIM_JITTER)
+    if name == "keyboard":
+        return bike_input.KeyboardBackend()
+    try:
+        return bike_input.GPIOBackend(
+            {("P1", "A"): P1_SENSOR_A, ("P1", "B"): P1_SENSOR_B, ("P2", "A"): P2_SENSOR_A, ("P2", "B"): P2_SENSOR_B},
+            {"P1": P1_START, "P2": P2_START},
+            bouncetime=BOUNCE)
+    except (ImportError, RuntimeError) as e:
+        # Not on a Pi - RPi.GPIO is missing or refuses to load
+        print("Bike sensors not available, keyboard only.", e)
+        return bike_input.KeyboardBackend()
 
 # Ball settings
 BALL_SIZE = 20
 BALL_SPEED_X = BALL_SPEED
 BALL_SPEED_Y = BALL_SPEED
 
+# Physics - the ball is simulated at a fixed rate independent of the frame
+# rate and drawn interpolated between the last two physics states. ball_dir
+# stays in pixels per 1/60s, which is what the speed presets were tuned for.
+PHYSICS_HZ = 120
+PHYSICS_DT = 1.0 / PHYSICS_HZ
+MAX_FRAME_TIME = 0.25
+MAX_BOUNCES = 4
+
 # Game states
 READY = 0
 PLAYING = 1
 GAME_OVER = 2
-
-# Initialize screen
-# screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-screen = pygame.display.set_mode((800, 600), pygame.FULLSCREEN | pygame.SCALED)
-pygame.display.set_caption("BikePong")
-pygame.mouse.set_visible(False)
-
-# Clock for controlling frame rate
-clock = pygame.time.Clock()
+COUNTDOWN = 3
+COUNTDOWN_TIME = 3
+GAME_OVER_TIME = 10
+
+# High scores - every win is kept, ranked by the winning margin, and the
+# best few are shown on the ready screen
+HIGH_SCORE_FILE = "high_scores.db"
+SHOWN_SCORES = 3
+GRAY = (120, 120, 120)
+high_scores = HighScores(HIGH_SCORE_FILE, "pong")
+
+# Sensor event log - every edge is logged at DEBUG, idle resets at INFO
+LOG_FILE = "pong_events.log"
+LOG_LEVEL = telemetry.INFO
+event_log = telemetry.EventLog(LOG_FILE, level=LOG_LEVEL)
+
+# Spectator broadcast - set PONG_BROADCAST to e.g. 239.255.42.99:5005 (multicast)
+# or 127.0.0.1:5005 and run spectator.py with the same address
+BROADCAST_ADDRESS = os.environ.get("PONG_BROADCAST")
+BROADCAST_RATE = 30
+broadcaster = None
+
+# Rendering - while PLAYING only erase/redraw the paddles, ball and score
+# and push those rects. Set False to fall back to a full redraw every frame.
+DIRTY_RECTS = True
+
+# Display - set up by game_loop
+screen = None
+
+# Set when the window was closed rather than the game left with ESC
+quit_requested = False
+
+# Scene runtime, ticks the current game state once per frame
+# Frame profiling - F3 toggles the overlay, stats are written on exit
+PROFILE = False
+PROFILE_FILE = "pong_profile.json"
+scene_manager = SceneManager(fps=60, profiler=FrameProfiler(enabled=PROFILE, export_path=PROFILE_FILE))
+
+def new_decoder_state():
+    return {"edges": deque(maxlen=EDGE_HISTORY), "direction": 0, "last_step": None,
+            "period": None, "rate": 0.0, "pending": 0}
 
 player_state = {
-    "P1": {"last_trigger": None, "trigger_time": 0},
-    "P2": {"last_trigger": None, "trigger_time": 0},
+    "P1": new_decoder_state(),
+    "P2": new_decoder_state(),
 }
 
 # Global game variables
 ball_pos = [SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2]
 ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+prev_ball_pos = list(ball_pos)
 p1_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
 p2_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
 p1_score = 0
 p2_score = 0
 p1_ready_flag = False
 p2_ready_flag = False
-game_state = READY
 winner = None
+chaos = False
+balls = multiball.Balls(CHAOS_BALLS, SCREEN_WIDTH, SCREEN_HEIGHT, BALL_SIZE, MAX_BOUNCES)
+
+# Per-frame state
+frame_time = 0.0
+last_frame_time = None
+accumulator = 0.0
+frame_state = None
+drawn_state = None
+dirty = False
+dirty_rects = []
+erased_rects = []
 
 def reset_ball():
-    global ball_pos, ball_dir
+    global ball_pos, ball_dir, prev_ball_pos
     ball_pos = [SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2]
+    prev_ball_pos = list(ball_pos)
     ball_dir[0] = BALL_SPEED_X * (-1 if ball_dir[0] > 0 else 1)
     ball_dir[1] = BALL_SPEED_Y * (-1 if ball_dir[1] > 0 else 1)
 
+def sweep_rect(x, y, dx, dy, left, top, right, bottom):
+    # First time t in [0, 1] the point (x, y) + t * (dx, dy) enters the rect,
+    # and the axis it entered through (0 = x, 1 = y). Starting inside is not
+    # a hit, so a ball overlapping a paddle can never get stuck flipping.
+    t_enter = float("-inf")
+    t_exit = float("inf")
+    axis = None
+    for pos, delta, low, high, this_axis in ((x, dx, left, right, 0), (y, dy, top, bottom, 1)):
+        if delta == 0:
+            if pos <= low or pos >= high:
+                return None
+            continue
+        t0 = (low - pos) / delta
+        t1 = (high - pos) / delta
+        if t0 > t1:
+            t0, t1 = t1, t0
+        if t0 > t_enter:
+            t_enter = t0
+            axis = this_axis
+        t_exit = min(t_exit, t1)
+
+    if axis is None or t_enter < 0 or t_enter > 1 or t_enter >= t_exit:
+        return None
+    return t_enter, axis
+
+def step_ball(dt):
+    global prev_ball_pos, p1_score, p2_score
+    prev_ball_pos = list(ball_pos)
+    scale = dt * 60
+    remaining = 1.0
+
+    # Swept collision - move to the earliest wall/paddle hit, reflect, and
+    # carry on with what is left of the step
+    for _ in range(MAX_BOUNCES):
+        dx = ball_dir[0] * scale * remaining
+        dy = ball_dir[1] * scale * remaining
+        hit = None
+
+        if dy < 0:
+            hit = (max(0.0, -ball_pos[1] / dy), 1)
+        elif dy > 0:
+            hit = (max(0.0, (SCREEN_HEIGHT - BALL_SIZE - ball_pos[1]) / dy), 1)
+        if hit and hit[0] > 1:
+            hit = None
+
+        # Paddles grown by the ball size so the ball can be swept as a point
+        for paddle_x, paddle_y in ((50, p1_pos), (SCREEN_WIDTH - 50 - PADDLE_WIDTH, p2_pos)):
+            paddle_hit = sweep_rect(ball_pos[0], ball_pos[1], dx, dy,
+                                    paddle_x - BALL_SIZE, paddle_y - BALL_SIZE,
+                                    paddle_x + PADDLE_WIDTH, paddle_y + PADDLE_HEIGHT)
+            if paddle_hit and (hit is None or paddle_hit[0] < hit[0]):
+                hit = paddle_hit
+
+        if hit is None:
+            ball_pos[0] += dx
+            ball_pos[1] += dy
+            break
+
+        t, axis = hit
+        ball_pos[0] += dx * t
+        ball_pos[1] += dy * t
+        ball_dir[axis] = -ball_dir[axis]
+        remaining *= 1 - t
+
+    # Ball out of bounds
+    if ball_pos[0] <= 0:
+        p2_score += 1
+        reset_ball()
+    elif ball_pos[0] >= SCREEN_WIDTH - BALL_SIZE:
+        p1_score += 1
+        reset_ball()
+
+def clamp_paddle(pos):
+    return max(0, min(SCREEN_HEIGHT - PADDLE_HEIGHT, pos))
+
 def p1_up():
     global p1_pos
-    if p1_pos > 0:
-        p1_pos -= PADDLE_SPEED
+    p1_pos = clamp_paddle(p1_pos - PADDLE_SPEED)
 
 def p1_down():
     global p1_pos
-    if p1_pos < SCREEN_HEIGHT - PADDLE_HEIGHT:
-        p1_pos += PADDLE_SPEED
+    p1_pos = clamp_paddle(p1_pos + PADDLE_SPEED)
 
 def p2_up():
     global p2_pos
-    if p2_pos > 0:
-        p2_pos -= PADDLE_SPEED
+    p2_pos = clamp_paddle(p2_pos - PADDLE_SPEED)
 
 def p2_down():
     global p2_pos
-    if p2_pos < SCREEN_HEIGHT - PADDLE_HEIGHT:
-        p2_pos += PADDLE_SPEED
+    p2_pos = clamp_paddle(p2_pos + PADDLE_SPEED)
 
 def p1_ready(channel):
     global p1_ready_flag
@@ -113,228 +274,406 @@ def p2_ready(channel):
     global p2_ready_flag
     p2_ready_flag = True
 
+def start_pressed(player):
+    # Queued with the sensor edges so start presses are recorded and replayed
+    push_sensor_event(player, START)
+
+# Text rendering cache - fonts per size, rendered surfaces in a bounded LRU
+TEXT_CACHE_SIZE = 64
+font_cache = {}
+text_cache = OrderedDict()
+text_cache_stats = {"hits": 0, "misses": 0}
+
+def get_font(size):
+    font = font_cache.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        font_cache[size] = font
+    return font
+
+def render_text(text, size, color):
+    key = (text, size, tuple(color))
+    text_surf = text_cache.get(key)
+    if text_surf is not None:
+        text_cache.move_to_end(key)
+        text_cache_stats["hits"] += 1
+        return text_surf
+
+    text_cache_stats["misses"] += 1
+    text_surf = get_font(size).render(text, True, color)
+    text_cache[key] = text_surf
+    if len(text_cache) > TEXT_CACHE_SIZE:
+        text_cache.popitem(last=False)
+    return text_surf
+
 def display_text(text, size, color, position):
-    font = pygame.font.Font(None, size)
-    text_surf = font.render(text, True, color)
+    text_surf = render_text(text, size, color)
     text_rect = text_surf.get_rect(center=position)
     screen.blit(text_surf, text_rect)
-
-def countdown():
-    for i in range(3, 0, -1):
-        screen.fill(BLACK)
-        display_text("Player 1", 48, GREEN if p1_ready_flag else RED, (200, SCREEN_HEIGHT // 2))
-        display_text("Player 2", 48, GREEN if p2_ready_flag else RED, (SCREEN_WIDTH - 200, SCREEN_HEIGHT // 2))
-        display_text(str(i), 256, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100))
-        pygame.display.flip()
-        time.sleep(1)
-
-def handle_sensor_trigger(player, sensor):
-    current_time = time.time()
+    return text_rect
+
+# Sensor event queue - input backend callbacks only push (timestamp, player, sensor)
+# records into a preallocated ring buffer and game_loop drains it once per
+# frame. Backends deliver every callback on one thread, so there is a single
+# producer (owns the head) and a single consumer (owns the tail) - no lock.
+SENSOR_QUEUE_SIZE = 256
+START = "S"
+sensor_queue = [None] * SENSOR_QUEUE_SIZE
+sensor_queue_head = 0
+sensor_queue_tail = 0
+sensor_queue_stats = {"overflows": 0, "depth": 0, "max_depth": 0}
+
+def push_sensor_event(player, sensor):
+    global sensor_queue_head
+    head = sensor_queue_head
+    if head - sensor_queue_tail >= SENSOR_QUEUE_SIZE:
+        sensor_queue_stats["overflows"] += 1
+        return
+    sensor_queue[head % SENSOR_QUEUE_SIZE] = (time.perf_counter(), player, sensor)
+    sensor_queue_head = head + 1
+
+def drain_sensor_events():
+    global sensor_queue_tail
+    head = sensor_queue_head
+    tail = sensor_queue_tail
+    depth = head - tail
+    sensor_queue_stats["depth"] = depth
+    if depth > sensor_queue_stats["max_depth"]:
+        sensor_queue_stats["max_depth"] = depth
+
+    events = []
+    while tail < head:
+        events.append(sensor_queue[tail % SENSOR_QUEUE_SIZE])
+        tail += 1
+    sensor_queue_tail = tail
+
+    for timestamp, player, sensor in session.sensor_events(events):
+        if sensor == START:
+            if player == "P1":
+                p1_ready(None)
+            else:
+                p2_ready(None)
+        else:
+            handle_sensor_trigger(player, sensor, timestamp)
+
+def handle_sensor_trigger(player, sensor, current_time):
     state = player_state[player]
+    edges = state["edges"]
 
-    if state["trigger_time"] and current_time - state["trigger_time"] > 0.10:
-        print(f"{player} IDLE RESET")
-        state["last_trigger"] = None
-        state["trigger_count"] = 0
+    if edges and current_time - edges[-1][0] > IDLE_TIMEOUT:
+        event_log.info("idle_reset", player=player)
+        player_state[player] = state = new_decoder_state()
+        edges = state["edges"]
 
     # Initial trigger
-    if state["last_trigger"] is None:
-        print(f"{player} initial trigger: {sensor}")
-        state["last_trigger"] = sensor
-        state["trigger_time"] = current_time
-        state["trigger_count"] = 1
+    if not edges:
+        event_log.debug("initial_trigger", player=player, sensor=sensor)
+        edges.append((current_time, sensor))
         return
 
-    # Determine direction based on last trigger
-    if sensor == "A" and state["last_trigger"] == "B":
-        print(f"{player} FWD motion (A -> B).")
-        if player == "P1":
-            p1_down()
-            p1_down()
-            p1_down()
-        elif player == "P2":
-            p2_down()
-            p2_down()
-            p2_down()
-    elif sensor == "B" and state["last_trigger"] == "A":
-        print(f"{player} REV motion (B -> A).")
-        if player == "P1":
-            p1_up()
-            p1_up()
-            p1_up()
-        elif player == "P2":
-            p2_up()
-            p2_up()
-            p2_up()
-
-    # Update state
-    state["last_trigger"] = sensor
-    state["trigger_time"] = current_time
-    state["trigger_count"] += 1
-
-    # Reset state after two triggers
-    if state["trigger_count"] >= 2:
-        state["last_trigger"] = None
-        state["trigger_count"] = 0
-
-
-# GPIO callback functions
-def p1_sensor_a_callback(channel):
-    handle_sensor_trigger("P1", "A")
-
-def p1_sensor_b_callback(channel):
-    handle_sensor_trigger("P1", "B")
-
-def p2_sensor_a_callback(channel):
-    handle_sensor_trigger("P2", "A")
-
-def p2_sensor_b_callback(channel):
-    handle_sensor_trigger("P2", "B")
-
-# Setup GPIO event detection
-GPIO.add_event_detect(P1_SENSOR_A, GPIO.FALLING, callback=p1_sensor_a_callback, bouncetime=BOUNCE)
-GPIO.add_event_detect(P1_SENSOR_B, GPIO.FALLING, callback=p1_sensor_b_callback, bouncetime=BOUNCE)
-GPIO.add_event_detect(P2_SENSOR_A, GPIO.FALLING, callback=p2_sensor_a_callback, bouncetime=BOUNCE)
-GPIO.add_event_detect(P2_SENSOR_B, GPIO.FALLING, callback=p2_sensor_b_callback, bouncetime=BOUNCE)
-GPIO.add_event_detect(P1_START, GPIO.FALLING, callback=p1_ready, bouncetime=300)
-GPIO.add_event_detect(P2_START, GPIO.FALLING, callback=p2_ready, bouncetime=300)
-
-
-def game_loop():
-    global ball_pos, ball_dir, p1_score, p2_score, p1_ready_flag, p2_ready_flag, game_state, winner, p1_pos, p2_pos, BALL_SPEED_X, BALL_SPEED_Y
-    running = True
+    # A pair is a change of sensor with a shorter gap than the one before it -
+    # the long gap is the rest of the revolution. A repeated sensor means an
+    # edge was missed, the next change of sensor picks the pairing back up.
+    last_time, last_sensor = edges[-1]
+    gap = current_time - last_time
+    prev_gap = last_time - edges[-2][0] if len(edges) > 1 else PAIR_WINDOW
+    edges.append((current_time, sensor))
+    if sensor == last_sensor or gap >= prev_gap:
+        return
 
-    while running:
+    direction = 1 if sensor == "A" else -1
+    if state["last_step"] is None or direction != state["direction"]:
+        # No period yet - move a single step straight away
+        state["pending"] += direction
+        state["rate"] = 0.0
+        state["period"] = None
+    else:
+        period = current_time - state["last_step"]
+        rate = direction / period
+        state["period"] = period
+        if state["rate"]:
+            state["rate"] += DECODER_SMOOTHING * (rate - state["rate"])
+        else:
+            state["rate"] = rate
+    state["direction"] = direction
+    state["last_step"] = current_time
+    # Logged with the cadence the step gives, 0 until a rider has a period
+    _, rpm = rider_cadence(player, current_time)
+    event_log.debug("step", player=player, direction=direction, gap=round(gap, 4), rpm=round(rpm, 1))
+
+def step_rate(player, now):
+    # Signed pairs per second. Once the next pair is overdue the rider must be
+    # slowing, so the estimate decays with the time since the last pair.
+    state = player_state[player]
+    if state["period"] is None:
+        return 0.0
+    elapsed = now - state["last_step"]
+    if elapsed > IDLE_TIMEOUT:
+        return 0.0
+    if elapsed > state["period"]:
+        return state["rate"] * state["period"] / elapsed
+    return state["rate"]
+
+def rider_cadence(player, now):
+    # (angular velocity in rad/s, cadence in rpm) of a rider's cranks
+    revs_per_sec = step_rate(player, now) / PAIRS_PER_REV
+    return revs_per_sec * 2 * math.pi, abs(revs_per_sec) * 60
+
+def update_paddles(now, dt):
+    global p1_pos, p2_pos
+    for player in ("P1", "P2"):
+        state = player_state[player]
+        steps = state["pending"] + step_rate(player, now) * dt
+        state["pending"] = 0
+        if player == "P1":
+            p1_pos = clamp_paddle(p1_pos + steps * PADDLE_STEP)
+        else:
+            p2_pos = clamp_paddle(p2_pos + steps * PADDLE_STEP)
+
+
+def reset_game():
+    global p1_ready_flag, p2_ready_flag, p1_score, p2_score, p1_pos, p2_pos, accumulator
+    p1_ready_flag = False
+    p2_ready_flag = False
+    p1_score = 0
+    p2_score = 0
+    p1_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
+    p2_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
+    accumulator = 0.0
+    reset_ball()
+    if chaos:
+        balls.reset((BALL_SPEED_X, BALL_SPEED_Y), random)
+
+def win_score():
+    return CHAOS_WIN_SCORE if chaos else WIN_SCORE
+
+def paddle_rects():
+    return ((50, p1_pos, PADDLE_WIDTH, PADDLE_HEIGHT),
+            (SCREEN_WIDTH - 50 - PADDLE_WIDTH, p2_pos, PADDLE_WIDTH, PADDLE_HEIGHT))
+
+def step_balls(dt):
+    global p1_score, p2_score
+    p1_points, p2_points = balls.step(dt, paddle_rects(), (BALL_SPEED_X, BALL_SPEED_Y), random)
+    p1_score += p1_points
+    p2_score += p2_points
+
+def ready_screen(elapsed):
+    display_text("READY?", 72, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100))
+    display_text("Player 1", 48, GREEN if p1_ready_flag else RED, (200, SCREEN_HEIGHT // 2))
+    display_text("Player 2", 48, GREEN if p2_ready_flag else RED, (SCREEN_WIDTH - 200, SCREEN_HEIGHT // 2))
+    if chaos:
+        display_text(f"CHAOS - {CHAOS_BALLS} balls, first to {CHAOS_WIN_SCORE}", 32, RED, (SCREEN_WIDTH // 2, 40))
+    for i, (margin, result, _) in enumerate(high_scores.top(SHOWN_SCORES)):
+        display_text(result, 32, GRAY, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 100 + i * 36))
+
+    if p1_ready_flag and p2_ready_flag:
+        return COUNTDOWN
+
+def countdown(elapsed):
+    display_text("Player 1", 48, GREEN if p1_ready_flag else RED, (200, SCREEN_HEIGHT // 2))
+    display_text("Player 2", 48, GREEN if p2_ready_flag else RED, (SCREEN_WIDTH - 200, SCREEN_HEIGHT // 2))
+    display_text(str(COUNTDOWN_TIME - int(elapsed)), 256, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100))
+
+def playing(elapsed):
+    global accumulator, winner
+
+    # Fixed timestep ball movement
+    accumulator += frame_time
+    step = step_balls if chaos else step_ball
+    while accumulator >= PHYSICS_DT:
+        step(PHYSICS_DT)
+        accumulator -= PHYSICS_DT
+        if p1_score >= win_score() or p2_score >= win_score():
+            break
+
+    scene_manager.profiler.mark("sim")
+
+    # Draw paddles and ball, interpolated between physics steps
+    alpha = accumulator / PHYSICS_DT
+    for paddle in paddle_rects():
+        dirty_rects.append(pygame.draw.rect(screen, WHITE, paddle))
+    if chaos:
+        dirty_rects.extend(balls.draw(screen, WHITE, alpha))
+    else:
+        ball_x = prev_ball_pos[0] + (ball_pos[0] - prev_ball_pos[0]) * alpha
+        ball_y = prev_ball_pos[1] + (ball_pos[1] - prev_ball_pos[1]) * alpha
+        dirty_rects.append(pygame.draw.ellipse(screen, WHITE, (ball_x, ball_y, BALL_SIZE, BALL_SIZE)))
+
+    # Display score
+    dirty_rects.append(display_text(f"{p1_score} - {p2_score}", 48, WHITE, (SCREEN_WIDTH // 2, 50)))
+
+    # Check for win - with many balls both can get there in the same step,
+    # then the higher score wins
+    if max(p1_score, p2_score) >= win_score() and p1_score != p2_score:
+        winner = "Player 1" if p1_score > p2_score else "Player 2"
+        return GAME_OVER
+
+def record_result():
+    # Replays (and the benchmarks) don't go on the table, nor do chaos games
+    # with their much bigger margins
+    if not session.replaying and not chaos:
+        high, low = max(p1_score, p2_score), min(p1_score, p2_score)
+        high_scores.add(high - low, f"{winner} {high}-{low}")
+
+def game_over_screen(elapsed):
+    display_text(f"{winner} WINS!", 72, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+
+# Held keys read every frame
+PONG_KEYS = (pygame.K_w, pygame.K_s, pygame.K_UP, pygame.K_DOWN, pygame.K_1, pygame.K_2)
+
+def begin_frame(now):
+    global ball_dir, BALL_SPEED_X, BALL_SPEED_Y, frame_time, last_frame_time, chaos
+    global frame_state, dirty, dirty_rects, erased_rects
+    frame_time = 0.0 if last_frame_time is None else min(now - last_frame_time, MAX_FRAME_TIME)
+    last_frame_time = now
+
+    frame_state = scene_manager.current
+    profiler = scene_manager.profiler
+    dirty = (DIRTY_RECTS and frame_state == PLAYING and drawn_state == PLAYING
+             and not profiler.overlay and not profiler.redraw)
+    if dirty:
+        for rect in dirty_rects:
+            screen.fill(BLACK, rect)
+    else:
         screen.fill(BLACK)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    running = False
-                elif event.key == pygame.K_3:
-                    BALL_SPEED_X = 2.0
-                    BALL_SPEED_Y = 2.0
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_4:
-                    BALL_SPEED_X = 3.5
-                    BALL_SPEED_Y = 3.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_5:
-                    BALL_SPEED_X = 4.5
-                    BALL_SPEED_Y = 4.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_6:
-                    BALL_SPEED_X = 5.5
-                    BALL_SPEED_Y = 5.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_7:
-                    BALL_SPEED_X = 6.5
-                    BALL_SPEED_Y = 6.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_8:
-                    BALL_SPEED_X = 7.5
-                    BALL_SPEED_Y = 7.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                elif event.key == pygame.K_9:
-                    BALL_SPEED_X = 8.5
-                    BALL_SPEED_Y = 8.5
-                    ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
-                
-                # Update ball_dir when BALL_SPEED changes
-                ball_dir = [BALL_SPEED if ball_dir[0] > 0 else -BALL_SPEED, 
-                BALL_SPEED if ball_dir[1] > 0 else -BALL_SPEED]
-
-        keys = pygame.key.get_pressed()
-        # Player 1 controls (W/S)
-        if keys[pygame.K_w]:
-            p1_up()
-        if keys[pygame.K_s]:
-            p1_down()
-        # Player 2 controls (UP/DOWN)
-        if keys[pygame.K_UP]:
-            p2_up()
-        if keys[pygame.K_DOWN]:
-            p2_down()
-        # Ready buttons
-        if keys[pygame.K_1]:
-            p1_ready(True)
-        if keys[pygame.K_2]:
-            p2_ready(True)
-
-        if game_state == READY:
-            display_text("READY?", 72, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100))
-            display_text("Player 1", 48, GREEN if p1_ready_flag else RED, (200, SCREEN_HEIGHT // 2))
-            display_text("Player 2", 48, GREEN if p2_ready_flag else RED, (SCREEN_WIDTH - 200, SCREEN_HEIGHT // 2))
-
-            if p1_ready_flag and p2_ready_flag:
-                countdown()
-                game_state = PLAYING
-                p1_ready_flag = p2_ready_flag = False
-                p1_score = p2_score = 0
-                p1_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
-                p2_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
-                reset_ball()
-
-        elif game_state == PLAYING:
-            # Draw paddles and ball
-            pygame.draw.rect(screen, WHITE, (50, p1_pos, PADDLE_WIDTH, PADDLE_HEIGHT))
-            pygame.draw.rect(screen, WHITE, (SCREEN_WIDTH - 50 - PADDLE_WIDTH, p2_pos, PADDLE_WIDTH, PADDLE_HEIGHT))
-            pygame.draw.ellipse(screen, WHITE, (ball_pos[0], ball_pos[1], BALL_SIZE, BALL_SIZE))
-
-            # Ball movement
-            ball_pos[0] += ball_dir[0]
-            ball_pos[1] += ball_dir[1]
-
-            # Ball collision with top/bottom
-            if ball_pos[1] <= 0 or ball_pos[1] >= SCREEN_HEIGHT - BALL_SIZE:
-                ball_dir[1] = -ball_dir[1]
-
-            # Ball collision with paddles
-            if (50 <= ball_pos[0] <= 50 + PADDLE_WIDTH and p1_pos < ball_pos[1] + BALL_SIZE // 2 < p1_pos + PADDLE_HEIGHT) or \
-               (SCREEN_WIDTH - 50 - PADDLE_WIDTH <= ball_pos[0] + BALL_SIZE <= SCREEN_WIDTH - 50 and p2_pos < ball_pos[1] + BALL_SIZE // 2 < p2_pos + PADDLE_HEIGHT):
-                ball_dir[0] = -ball_dir[0]
-
-            # Ball out of bounds
-            if ball_pos[0] <= 0:
-                p2_score += 1
-                reset_ball()
-            elif ball_pos[0] >= SCREEN_WIDTH - BALL_SIZE:
-                p1_score += 1
-                reset_ball()
-
-            # Display score
-            display_text(f"{p1_score} - {p2_score}", 48, WHITE, (SCREEN_WIDTH // 2, 50))
-
-            # Check for win
-            if p1_score >= WIN_SCORE:
-                winner = "Player 1"
-                game_state = GAME_OVER
-                end_time = time.time()
-            elif p2_score >= WIN_SCORE:
-                winner = "Player 2"
-                game_state = GAME_OVER
-                end_time = time.time()
-
-        elif game_state == GAME_OVER:
-            display_text(f"{winner} WINS!", 72, WHITE, (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-            if time.time() - end_time > 10:
-                # Reset all game variables
-                game_state = READY
-                p1_ready_flag = False
-                p2_ready_flag = False
-                p1_score = 0
-                p2_score = 0
-                p1_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
-                p2_pos = SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2
-                reset_ball()
-
-        pygame.display.flip()
-        clock.tick(60)
-
-    pygame.mouse.set_visible(True)
-    pygame.quit()
+    erased_rects = dirty_rects
+    dirty_rects = []
+    scene_manager.profiler.mark("draw")
+
+    for event in session.events():
+        if event.type == pygame.QUIT:
+            stop(quit=True)
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                stop()
+            elif event.key == pygame.K_F3:
+                scene_manager.profiler.toggle_overlay()
+            elif event.key == pygame.K_c and frame_state == READY:
+                chaos = not chaos
+            elif event.key == pygame.K_3:
+                BALL_SPEED_X = 2.0
+                BALL_SPEED_Y = 2.0
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_4:
+                BALL_SPEED_X = 3.5
+                BALL_SPEED_Y = 3.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_5:
+                BALL_SPEED_X = 4.5
+                BALL_SPEED_Y = 4.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_6:
+                BALL_SPEED_X = 5.5
+                BALL_SPEED_Y = 5.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_7:
+                BALL_SPEED_X = 6.5
+                BALL_SPEED_Y = 6.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_8:
+                BALL_SPEED_X = 7.5
+                BALL_SPEED_Y = 7.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+            elif event.key == pygame.K_9:
+                BALL_SPEED_X = 8.5
+                BALL_SPEED_Y = 8.5
+                ball_dir = [BALL_SPEED_X, BALL_SPEED_Y]
+
+            # Update ball_dir when BALL_SPEED changes
+            ball_dir = [BALL_SPEED if ball_dir[0] > 0 else -BALL_SPEED, 
+            BALL_SPEED if ball_dir[1] > 0 else -BALL_SPEED]
+
+    scene_manager.profiler.mark("events")
+
+    drain_sensor_events()
+    update_paddles(now, frame_time)
+
+    keys = session.pressed(PONG_KEYS)
+    # Player 1 controls (W/S)
+    if pygame.K_w in keys:
+        p1_up()
+    if pygame.K_s in keys:
+        p1_down()
+    # Player 2 controls (UP/DOWN)
+    if pygame.K_UP in keys:
+        p2_up()
+    if pygame.K_DOWN in keys:
+        p2_down()
+    # Ready buttons
+    if pygame.K_1 in keys:
+        p1_ready(True)
+    if pygame.K_2 in keys:
+        p2_ready(True)
+
+def present():
+    global drawn_state
+    if dirty:
+        framebuffer.present(erased_rects + dirty_rects)
+    else:
+        framebuffer.present()
+    drawn_state = frame_state
+
+    if broadcaster and broadcaster.due(scene_manager.now):
+        # Spectators only see the first ball in chaos mode
+        pos, direction = (balls.pos[0].tolist(), balls.dir[0].tolist()) if chaos else (ball_pos, ball_dir)
+        broadcaster.publish(scene_manager.now, (pos[0], pos[1], direction[0], direction[1],
+                                                p1_pos, p2_pos, p1_score, p2_score, frame_state))
+
+def stop(quit=False):
+    global quit_requested
+    quit_requested = quit
+    scene_manager.stop()
+
+def game_loop(display=None, controller=None):
+    # Runs until ESC or the window is closed. Without a display this is the
+    # whole program - it opens its own display and shuts pygame down at the
+    # end, the launcher passes in its own instead. Pong has no HID controller.
+    global screen, broadcaster, quit_requested, last_frame_time, drawn_state
+    global sensor_queue_head, sensor_queue_tail
+    standalone = display is None
+    if standalone:
+        pygame.init()
+        # display = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        display = framebuffer.open_display((800, 600), pygame.FULLSCREEN | pygame.SCALED)
+        pygame.display.set_caption("BikePong")
+        pygame.mouse.set_visible(False)
+    screen = display
+    quit_requested = False
+    last_frame_time = None
+    drawn_state = None
+    # Decoder times from an earlier run (or recording) mean nothing now, nor
+    # do edges and start presses it left in the queue
+    for player in player_state:
+        player_state[player] = new_decoder_state()
+    sensor_queue_head = sensor_queue_tail = 0
+    for key in sensor_queue_stats:
+        sensor_queue_stats[key] = 0
+
+    scene_manager.add(READY, ready_screen, enter=reset_game)
+    scene_manager.add(COUNTDOWN, countdown, duration=COUNTDOWN_TIME, next_scene=PLAYING)
+    scene_manager.add(PLAYING, playing, enter=reset_game)
+    scene_manager.add(GAME_OVER, game_over_screen, enter=record_result, duration=GAME_OVER_TIME, next_scene=READY)
+    # First, before any threads or files are opened. A replay brings its
+    # own sensor edges.
+    input_backend = create_input_backend("keyboard" if replay.REPLAY_FILE else INPUT_BACKEND)
+    event_log.start()
+    session.start("pong")
+    high_scores.start()
+    input_backend.start(push_sensor_event, start_pressed)
+    if BROADCAST_ADDRESS:
+        broadcaster = spectator.Broadcaster(BROADCAST_ADDRESS, rate=BROADCAST_RATE)
+    scene_manager.run(READY, frame=begin_frame, present=present)
+    input_backend.stop()
+    if broadcaster:
+        broadcaster.close()
+        broadcaster = None
+    event_log.stop()
+    high_scores.stop()
+
+    if standalone:
+        pygame.mouse.set_visible(True)
+        framebuffer.close_display()
+        pygame.quit()
 
 if __name__ == "__main__":
     game_loop()
@@ -0,0 +1,129 @@
+import csv
+import json
+import time
+from collections import deque
+import pygame
+
+# Per-frame phase profiler. start_frame() opens a frame and each mark(phase)
+# charges the time since the previous mark to that phase. The last WINDOW
+# frames are kept per phase for p50/p95/p99. While disabled every call is a
+# single attribute check, so the hooks can stay in place.
+
+WINDOW = 600
+OVERLAY_REFRESH = 0.5
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class FrameProfiler:
+    def __init__(self, enabled=False, export_path=None, window=WINDOW):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.window = window
+        self.samples = {}
+        self.frame = {}
+        self.frames = 0
+        self.last = 0.0
+        self.overlay = False
+        # Set for the frame the overlay is hidden and the one after, a game
+        # drawing only what changed redraws everything to get rid of it
+        self.redraw = False
+        self.overlay_lines = []
+        self.overlay_time = 0.0
+        self.font = None
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        self.frame = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.frame[phase] = self.frame.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled or not self.frame:
+            return
+        total = 0.0
+        for phase, duration in self.frame.items():
+            total += duration
+            if phase not in self.samples:
+                self.samples[phase] = deque(maxlen=self.window)
+            self.samples[phase].append(duration)
+        if "frame" not in self.samples:
+            self.samples["frame"] = deque(maxlen=self.window)
+        self.samples["frame"].append(total)
+        self.frames += 1
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if not self.overlay:
+            self.redraw = True
+        if self.overlay and not self.enabled:
+            # Turned on mid-frame, start timing from here
+            self.enabled = True
+            self.start_frame()
+
+    def stats(self):
+        result = {}
+        for phase, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[phase] = {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+            }
+        return result
+
+    def draw_overlay(self, surface):
+        # Compact table in the top left corner, refreshed twice a second
+        if not self.overlay:
+            return None
+        now = time.perf_counter()
+        if now - self.overlay_time > OVERLAY_REFRESH:
+            if self.font is None:
+                self.font = pygame.font.Font(None, 20)
+            lines = ["phase      p50   p95   p99 ms"]
+            for phase, row in self.stats().items():
+                lines.append(f"{phase:<8} {row['p50_ms']:5.2f} {row['p95_ms']:5.2f} {row['p99_ms']:5.2f}")
+            self.overlay_lines = [self.font.render(line, True, (255, 255, 0), (0, 0, 0)) for line in lines]
+            self.overlay_time = now
+
+        rect = pygame.Rect(4, 4, 0, 0)
+        y = 4
+        for line in self.overlay_lines:
+            rect.union_ip(surface.blit(line, (4, y)))
+            y += line.get_height()
+        return rect
+
+    def dump(self, path=None, pacing=None):
+        # pacing is the scene manager's achieved fps and idle time for a paced
+        # run, it goes in the JSON only, the CSV is one row per phase
+        path = path or self.export_path
+        if not path or not self.frames:
+            return
+        stats = self.stats()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["phase", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                for phase, row in stats.items():
+                    writer.writerow([phase, row["count"], row["mean_ms"], row["p50_ms"],
+                                     row["p95_ms"], row["p99_ms"], row["max_ms"]])
+        else:
+            with open(path, "w") as f:
+                result = {"frames": self.frames, "phases": stats}
+                if pacing:
+                    result["pacing"] = pacing
+                json.dump(result, f, indent=2)
@@ -0,0 +1,212 @@
+import os
+import random
+import struct
+import time
+import pygame
+
+# Input recording and replay. Every input a game consumes goes through the
+# module level session: the frame clock, pygame key events, held keys, HID
+# controller events and bike sensor edges, plus the RNG seed. Recording
+# writes them to a compact binary log, replay feeds them back frame by frame
+# either at the recorded pace or as fast as possible.
+#
+#   ARCADE_RECORD=path        record this run
+#   ARCADE_REPLAY=path        replay a recording
+#   ARCADE_REPLAY_FAST=1      replay without waiting
+
+RECORD_FILE = os.environ.get("ARCADE_RECORD")
+REPLAY_FILE = os.environ.get("ARCADE_REPLAY")
+REPLAY_FAST = os.environ.get("ARCADE_REPLAY_FAST") == "1"
+
+MAGIC = b"ARCR"
+VERSION = 2
+HEADER = struct.Struct("<4sBQB")
+RECORD = struct.Struct("<BH")
+
+# Record kinds
+FRAME = 0
+EVENT = 1
+HID = 2
+SENSOR = 3
+KEYS = 4
+
+FRAME_DATA = struct.Struct("<d")
+EVENT_DATA = struct.Struct("<Ii")
+HID_DATA = struct.Struct("<di")
+SENSOR_DATA = struct.Struct("<d2s1s")
+
+# Only these events matter to the games
+RECORDED_EVENTS = (pygame.QUIT, pygame.KEYDOWN)
+
+
+class Session:
+    def __init__(self):
+        self.recording = False
+        self.replaying = False
+        self.fast = False
+        self.finished = False
+        self.file = None
+        self.seed = None
+        self.frames = []
+        self.frame_index = -1
+        self.current = None
+        self.pressed_keys = set()
+        self.replay_start = None
+
+    def start(self, game, record_path=None, replay_path=None, fast=None):
+        # Paths default to the module settings at the time of the call. A
+        # launcher runs several games in one process, start from scratch.
+        record_path = record_path or RECORD_FILE
+        replay_path = replay_path or REPLAY_FILE
+        fast = REPLAY_FAST if fast is None else fast
+        self.__init__()
+        if replay_path:
+            self.load(game, replay_path)
+            self.replaying = True
+            self.fast = fast
+        elif record_path:
+            self.seed = random.SystemRandom().getrandbits(63)
+            name = game.encode()
+            self.file = open(record_path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, self.seed, len(name)) + name)
+            self.recording = True
+        if self.seed is not None:
+            random.seed(self.seed)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.recording = False
+        self.replaying = False
+
+    def write(self, kind, payload=b""):
+        self.file.write(RECORD.pack(kind, len(payload)) + payload)
+
+    def load(self, game, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, self.seed, name_len = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a recording")
+        offset = HEADER.size
+        name = data[offset:offset + name_len].decode()
+        if name != game:
+            raise ValueError(f"{path} is a {name} recording, not {game}")
+        offset += name_len
+
+        frame = None
+        while offset < len(data):
+            kind, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == FRAME:
+                frame = {"now": FRAME_DATA.unpack(payload)[0], "events": [], "hid": [], "sensor": [], "keys": None}
+                self.frames.append(frame)
+            elif kind == EVENT:
+                frame["events"].append(EVENT_DATA.unpack(payload))
+            elif kind == HID:
+                frame["hid"].append(HID_DATA.unpack(payload))
+            elif kind == SENSOR:
+                timestamp, player, sensor = SENSOR_DATA.unpack(payload)
+                frame["sensor"].append((timestamp, player.decode(), sensor.decode()))
+            elif kind == KEYS:
+                frame["keys"] = set(struct.unpack(f"<{length // 4}i", payload))
+
+    def frame(self, now):
+        # Start a frame, returns the frame time to use or None when a replay
+        # has run out of frames
+        if self.recording:
+            self.write(FRAME, FRAME_DATA.pack(now))
+            return now
+        if not self.replaying:
+            return now
+
+        self.frame_index += 1
+        if self.frame_index >= len(self.frames):
+            self.finished = True
+            return None
+        self.current = self.frames[self.frame_index]
+        recorded = self.current["now"]
+        if self.replay_start is None:
+            self.replay_start = (now, recorded)
+        elif not self.fast:
+            delay = (recorded - self.replay_start[1]) - (now - self.replay_start[0])
+            if delay > 0:
+                time.sleep(delay)
+        return recorded
+
+    def events(self):
+        if self.replaying:
+            pygame.event.pump()
+            current, self.current["events"] = self.current["events"], []
+            return [pygame.event.Event(event_type, key=key) for event_type, key in current]
+
+        events = pygame.event.get()
+        if self.recording:
+            for event in events:
+                if event.type in RECORDED_EVENTS:
+                    self.write(EVENT, EVENT_DATA.pack(event.type, getattr(event, "key", 0)))
+        return events
+
+    def pressed(self, keys):
+        # Set of the given keys that are held down
+        if self.replaying:
+            if self.current["keys"] is not None:
+                self.pressed_keys = self.current["keys"]
+            return self.pressed_keys
+
+        state = pygame.key.get_pressed()
+        pressed = {key for key in keys if state[key]}
+        if self.recording and pressed != self.pressed_keys:
+            self.write(KEYS, struct.pack(f"<{len(pressed)}i", *pressed))
+        self.pressed_keys = pressed
+        return pressed
+
+    def hid_events(self, events):
+        # events is a list of (timestamp, key) drained from a HIDReader
+        if self.replaying:
+            return self.current["hid"]
+        if self.recording:
+            for timestamp, key in events:
+                self.write(HID, HID_DATA.pack(timestamp, key))
+        return events
+
+    def sensor_events(self, events):
+        # events is a list of (timestamp, player, sensor) drained this frame
+        if self.replaying:
+            return self.current["sensor"]
+        if self.recording:
+            for timestamp, player, sensor in events:
+                self.write(SENSOR, SENSOR_DATA.pack(timestamp, player.encode(), sensor.encode()))
+        return events
+
+
+def write_recording(path, game, seed, frames):
+    # Write frames in the shape Session.load reads them, for scripted input
+    # like the benchmarks'. Each frame is a dict with "now" and optionally
+    # "events" [(type, key)], "hid" [(timestamp, key)], "sensor"
+    # [(timestamp, player, sensor)] and "keys" (held set, when it changed).
+    # SceneManager.run takes one frame before its loop to start the clock,
+    # so like a real recording this starts with an empty lead-in frame and
+    # every scripted frame's input is delivered.
+    name = game.encode()
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, seed, len(name)) + name)
+        if frames:
+            lead_in = FRAME_DATA.pack(frames[0]["now"])
+            f.write(RECORD.pack(FRAME, len(lead_in)) + lead_in)
+        for frame in frames:
+            records = [(FRAME, FRAME_DATA.pack(frame["now"]))]
+            records += [(EVENT, EVENT_DATA.pack(*event)) for event in frame.get("events", ())]
+            records += [(HID, HID_DATA.pack(*event)) for event in frame.get("hid", ())]
+            records += [(SENSOR, SENSOR_DATA.pack(timestamp, player.encode(), sensor.encode()))
+                        for timestamp, player, sensor in frame.get("sensor", ())]
+            if frame.get("keys") is not None:
+                keys = frame["keys"]
+                records.append((KEYS, struct.pack(f"<{len(keys)}i", *keys)))
+            f.write(b"".join(RECORD.pack(kind, len(payload)) + payload for kind, payload in records))
+
+
+session = Session()
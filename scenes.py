@@ -0,0 +1,170 @@
+import time
+import pygame
+from profiler import FrameProfiler
+from replay import session
+import framebuffer
+
+# Shared scene runtime for the games. Each screen (ready, countdown, playing,
+# game over) is a scene ticked once per frame from a single loop, and timed
+# scenes move on by themselves, so nothing blocks and input keeps flowing
+# during transitions.
+
+MAX_WAIT = 1.0
+
+
+class Scene:
+    def __init__(self, tick, enter=None, duration=None, next_scene=None):
+        self.tick = tick
+        self.enter = enter
+        self.duration = duration
+        self.next_scene = next_scene
+
+
+class SceneManager:
+    def __init__(self, fps=60, profiler=None, paced=False, poll_interval=None):
+        # A paced manager does not run at a fixed fps. After each frame it
+        # sleeps until the next deadline - a scene's wake_at request, the end
+        # of a timed scene or the poll_interval for inputs that cannot be
+        # waited on - or until a pygame event arrives, and it only presents
+        # frames where the scene set drawn.
+        self.fps = fps
+        self.profiler = profiler or FrameProfiler()
+        self.paced = paced
+        self.poll_interval = poll_interval
+        self.scenes = {}
+        self.current = None
+        self.started = 0.0
+        self.scene_frames = 0
+        self.now = time.perf_counter()
+        self.running = False
+        self.clock = pygame.time.Clock()
+        self.wake_at = None
+        self.drawn = False
+        self.frames = 0
+        self.presents = 0
+        self.idle_time = 0.0
+        self.run_time = 0.0
+
+    def add(self, name, tick, enter=None, duration=None, next_scene=None):
+        # tick(elapsed) draws the scene and returns the next scene name, or None
+        # to stay. Scenes with a duration switch to next_scene when it is up.
+        self.scenes[name] = Scene(tick, enter, duration, next_scene)
+
+    def switch(self, name, now=None):
+        self.current = name
+        self.started = time.perf_counter() if now is None else now
+        self.scene_frames = 0
+        enter = self.scenes[name].enter
+        if enter:
+            enter()
+
+    def ticks(self):
+        # Frame time in ms, use this rather than pygame.time.get_ticks() so
+        # recordings replay the same
+        return int(self.now * 1000)
+
+    def tick(self, now):
+        scene = self.scenes[self.current]
+        if scene.duration is not None and now - self.started >= scene.duration:
+            self.switch(scene.next_scene, now)
+            scene = self.scenes[self.current]
+
+        next_scene = scene.tick(now - self.started)
+        self.scene_frames += 1
+        if next_scene is not None and next_scene != self.current:
+            self.switch(next_scene, now)
+
+    def stop(self):
+        self.running = False
+
+    def wait(self):
+        deadline = self.wake_at
+        scene = self.scenes[self.current]
+        if scene.duration is not None:
+            end = self.started + scene.duration
+            deadline = end if deadline is None else min(deadline, end)
+        if self.poll_interval:
+            poll = time.perf_counter() + self.poll_interval
+            deadline = poll if deadline is None else min(deadline, poll)
+        self.wake_at = None
+
+        # Wake at least every MAX_WAIT so nothing can sleep forever
+        start = time.perf_counter()
+        if deadline is None:
+            deadline = start + MAX_WAIT
+        timeout = int((deadline - start) * 1000) + 1
+        # Anything already queued is for the next frame straight away, taking
+        # it off to wait would put it back behind the rest
+        if timeout <= 0 or pygame.event.peek():
+            return
+        event = pygame.event.wait(timeout)
+        # Put it back for the frame's own event pump, ahead of any that came
+        # in with it
+        if event.type != pygame.NOEVENT:
+            rest = pygame.event.get()
+            pygame.event.post(event)
+            for other in rest:
+                pygame.event.post(other)
+        self.idle_time += time.perf_counter() - start
+
+    def pacing_stats(self):
+        # Figures for the last run, exported with the profile of a paced run
+        if not self.run_time:
+            return {"fps": 0.0, "present_fps": 0.0, "idle_pct": 0.0}
+        return {
+            "fps": self.frames / self.run_time,
+            "present_fps": self.presents / self.run_time,
+            "idle_pct": self.idle_time / self.run_time * 100,
+        }
+
+    def run(self, first, frame=None, present=None):
+        # frame(now) runs before the scene every frame for work shared by all
+        # scenes (event pump, controller reads), present() pushes the frame out
+        profiler = self.profiler
+        fps = 0 if session.replaying else self.fps
+        paced = self.paced and not session.replaying
+        run_start = time.perf_counter()
+        self.running = True
+        self.frames = 0
+        self.presents = 0
+        self.idle_time = 0.0
+        self.now = session.frame(time.perf_counter())
+        self.switch(first, self.now)
+        try:
+            while self.running:
+                profiler.start_frame()
+                redrawn = profiler.redraw
+                now = session.frame(time.perf_counter())
+                if now is None:
+                    break
+                self.now = now
+                if frame:
+                    frame(now)
+                if not self.running:
+                    break
+                profiler.mark("input")
+                self.drawn = False
+                self.tick(now)
+                if profiler.overlay:
+                    profiler.draw_overlay(framebuffer.get_surface())
+                profiler.mark("draw")
+                if not self.paced or self.drawn or profiler.overlay or profiler.redraw:
+                    if present:
+                        present()
+                    else:
+                        framebuffer.present()
+                    self.presents += 1
+                profiler.mark("present")
+                self.frames += 1
+                if redrawn:
+                    profiler.redraw = False
+                if paced:
+                    self.wait()
+                else:
+                    self.clock.tick(fps)
+                profiler.mark("idle")
+                profiler.end_frame()
+        finally:
+            self.run_time = time.perf_counter() - run_start
+            profiler.dump(pacing=self.pacing_stats() if paced else None)
+            session.close()
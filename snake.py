@@ -1,20 +1,30 @@
 import pygame
-import sys
 import random
-import hid  # hidapi
+from collections import deque
 from pygame.locals import *
+from scenes import SceneManager
+from replay import session
+from profiler import FrameProfiler
+from hid_input import HIDReader, open_device
+from highscores import HighScores
+import framebuffer
 
 move_delay = 250
 
+# Paced mode - sleep until the next move or input instead of spinning, and
+# only redraw when something changed
+PACED = True
+
+# Turns queued between moves, applied one per move
+TURN_BUFFER = 3
+
+# Rendering - the board lives on its own surface and a move only repaints
+# the cells it changed (head, tail, food) instead of the whole snake
+INCREMENTAL = True
+
 # Configuration
 USE_CONTROLLER = True
 
-# Initialize Pygame
-pygame.init()
-screen = pygame.display.set_mode((800, 600), pygame.FULLSCREEN)
-pygame.display.set_caption("Snake")
-pygame.mouse.set_visible(False)
-
 # Colors
 BLACK = (25, 0, 50)
 WHITE = (255, 255, 255)
@@ -22,27 +32,83 @@ GREEN = (0, 255, 0)
 RED = (255, 0, 0)
 GRAY = (120, 120, 120)
 
-# Font
-font_large = pygame.font.SysFont('Courier New', 48, bold=True)
-font_huge = pygame.font.SysFont('Courier New', 96, bold=True)
+# Display, board surface and fonts - set up by game_loop
+screen = None
+board = None
+font_large = None
+font_huge = None
+font_small = None
+dirty_rects = []
+full_update = True
 
 # Game area
 CELL_SIZE = 60  # Bigger cells to take more space
 GRID_WIDTH = 800 // CELL_SIZE
 GRID_HEIGHT = 600 // CELL_SIZE
 
-# Controller setup
-if USE_CONTROLLER:
-    try:
-        controller = hid.device()
-        controller.open(0x1c59, 0x0026) 
-        controller.set_nonblocking(True)
-        controller_connected = True
-    except Exception as e:
-        controller_connected = False
-        print("Controller not connected.", e)
-else:
-    controller_connected = False
+# Game states
+READY = 0
+PLAYING = 1
+GAME_OVER = 2
+GAME_OVER_TIME = 3
+
+# High scores - kept across runs, the best few are shown on the ready screen
+HIGH_SCORE_FILE = "high_scores.db"
+SHOWN_SCORES = 5
+high_scores = HighScores(HIGH_SCORE_FILE, "snake")
+score_rank = None
+
+# Frame profiling - F3 toggles the overlay, stats are written on exit
+PROFILE = False
+PROFILE_FILE = "snake_profile.json"
+scene_manager = SceneManager(fps=60, profiler=FrameProfiler(enabled=PROFILE, export_path=PROFILE_FILE), paced=PACED)
+input_keys = []
+snake = deque()
+direction = [0, -1]
+turns = deque()
+food = None
+
+# Board - occupancy per cell (index y * GRID_WIDTH + x) plus an index of the
+# free cells, so collision checks and food placement are O(1)
+occupied = bytearray(GRID_WIDTH * GRID_HEIGHT)
+free_cells = []
+free_slot = []
+score = 0
+last_move = 0
+
+# Controller reports
+JOY_MAP = {
+    (0x7F, 0x00): K_UP,
+    (0x7F, 0xFF): K_DOWN,
+    (0x00, 0x7F): K_LEFT,
+    (0xFF, 0x7F): K_RIGHT,
+}
+IDLE_REPORT = [0x7F, 0x7F, 0x80, 0x80, 0x80, 0x80, 0x00, 0x00]
+START_BTN = 0x04
+
+TURNS = {K_UP: [0, -1], K_DOWN: [0, 1], K_LEFT: [-1, 0], K_RIGHT: [1, 0]}
+
+def decode_report(data):
+    if data[:8] == IDLE_REPORT:
+        return None
+    xy = tuple(data[:2])
+    if xy in JOY_MAP:
+        return JOY_MAP[xy]
+    if data[6] == START_BTN:
+        return K_SPACE
+    return None
+
+# Controller - reports are read on a background thread while a game runs
+CONTROLLER_ID = (0x1c59, 0x0026)
+reader = None
+
+# Set when the window was closed rather than the game left with ESC
+quit_requested = False
+
+def stop(quit=False):
+    global quit_requested
+    quit_requested = quit
+    scene_manager.stop()
 
 def draw_text(text, font, color, surface, x, y):
     text_obj = font.render(text, True, color)
@@ -50,121 +116,238 @@ def draw_text(text, font, color, surface, x, y):
     surface.blit(text_obj, text_rect)
 
 def check_input():
-    global controller_connected
-
-    joy_map = {
-        (0x7F, 0x00): K_UP,
-        (0x7F, 0xFF): K_DOWN,
-        (0x00, 0x7F): K_LEFT,
-        (0xFF, 0x7F): K_RIGHT,
-    }
-    idle = [0x7F, 0x7F, 0x80, 0x80, 0x80, 0x80, 0x00, 0x00]
-    start_btn = 0x04
-
+    # Every key pressed since the last frame, in order
+    keys = []
     try:
-        for event in pygame.event.get():
+        for event in session.events():
             if event.type == QUIT:
-                pygame.mouse.set_visible(True)
-                pygame.quit()
-                sys.exit()
+                stop(quit=True)
             if event.type == KEYDOWN:
                 if event.key == K_ESCAPE:
-                    pygame.mouse.set_visible(True)
-                    pygame.quit()
-                    sys.exit()
-                return event.key
+                    stop()
+                keys.append(event.key)
     except Exception as e:
         print("Pygame event error:", e)
         # skip bad events
+    scene_manager.profiler.mark("events")
 
-    if controller_connected:
-        try:
-            data = controller.read(64)
-            if data and data[:8] != idle:
-                xy = tuple(data[:2])
-                if xy in joy_map:
-                    return joy_map[xy]
-                if data[6] == start_btn:
-                    return K_SPACE
-        except OSError:
-            print("Controller read error, disabling controller input.")
-            controller_connected = False
+    for timestamp, key in session.hid_events(reader.drain() if reader else []):
+        keys.append(key)
+    return keys
 
-    return None
 
+def ready_screen(elapsed):
+    global full_update
+    if scene_manager.scene_frames == 0 or scene_manager.profiler.redraw:
+        screen.fill(BLACK)
+        full_update = True
+        draw_text("Ready?", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
+        draw_high_scores(screen.get_height() // 2 + 70)
+        scene_manager.drawn = True
+    if input_keys:
+        return PLAYING
 
-def ready_screen():
-    screen.fill(BLACK)
-    draw_text("Ready?", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
-    pygame.display.update()
-    while not check_input():
-        pygame.time.wait(100)
+def draw_high_scores(y):
+    for i, (best, _, _) in enumerate(high_scores.top(SHOWN_SCORES)):
+        draw_text(f"{i + 1}. {best}", font_small, GRAY, screen, screen.get_width() // 2, y + i * 32)
+
+def record_score():
+    # Replays (and the benchmarks) don't go on the table
+    global score_rank
+    score_rank = None if session.replaying else high_scores.add(score)
 
-def game_over_screen(score, snake, food):
+def game_over_screen(elapsed):
+    global full_update
+    if scene_manager.scene_frames and not scene_manager.profiler.redraw:
+        return
     screen.fill(BLACK)
+    full_update = True
     for segment in snake:
         pygame.draw.rect(screen, GRAY, (segment[0]*CELL_SIZE, segment[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
-    pygame.draw.rect(screen, GRAY, (food[0]*CELL_SIZE, food[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
+    if food:
+        pygame.draw.rect(screen, GRAY, (food[0]*CELL_SIZE, food[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
     draw_text(f"{score}", font_huge, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
-    pygame.display.update()
-    pygame.time.wait(3000)
+    if score_rank:
+        draw_text(f"High score #{score_rank}", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2 + 90)
+    scene_manager.drawn = True
+
+def cell_index(x, y):
+    return y * GRID_WIDTH + x
+
+def reset_board():
+    global occupied, free_cells, free_slot
+    occupied = bytearray(GRID_WIDTH * GRID_HEIGHT)
+    free_cells = list(range(GRID_WIDTH * GRID_HEIGHT))
+    free_slot = list(range(GRID_WIDTH * GRID_HEIGHT))
+
+def occupy(cell):
+    # Swap the last free cell into this cell's slot
+    occupied[cell] = 1
+    slot = free_slot[cell]
+    last = free_cells.pop()
+    if last != cell:
+        free_cells[slot] = last
+        free_slot[last] = slot
 
-def random_food(snake):
-    while True:
-        pos = [random.randint(0, GRID_WIDTH - 1), random.randint(0, GRID_HEIGHT - 1)]
-        if pos not in snake:
-            return pos
+def vacate(cell):
+    occupied[cell] = 0
+    free_slot[cell] = len(free_cells)
+    free_cells.append(cell)
 
-def snake_game():
-    snake = [[GRID_WIDTH // 2, GRID_HEIGHT // 2]]
+def random_food():
+    # None when the snake fills the board
+    if not free_cells:
+        return None
+    cell = random.choice(free_cells)
+    return (cell % GRID_WIDTH, cell // GRID_WIDTH)
+
+def new_game():
+    global snake, direction, food, score, last_move
+    reset_board()
+    snake = deque([(GRID_WIDTH // 2, GRID_HEIGHT // 2)])
+    occupy(cell_index(*snake[0]))
     direction = [0, -1]
-    food = random_food(snake)
-    clock = pygame.time.Clock()
+    turns.clear()
+    food = random_food()
     score = 0
-    
-    last_move = pygame.time.get_ticks()
+    last_move = scene_manager.ticks()
 
-    while True:
-        screen.fill(BLACK)
+def cell_color(pos):
+    if occupied[cell_index(*pos)]:
+        return GREEN
+    if pos == food:
+        return RED
+    return BLACK
 
-        # Draw snake
-        for segment in snake:
-            pygame.draw.rect(screen, GREEN, (segment[0]*CELL_SIZE, segment[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
+def paint_cell(pos):
+    rect = board.fill(cell_color(pos), (pos[0]*CELL_SIZE, pos[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
+    screen.blit(board, rect, rect)
+    dirty_rects.append(rect)
 
-        # Draw food
-        pygame.draw.rect(screen, RED, (food[0]*CELL_SIZE, food[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
+def repaint_board():
+    global full_update
+    board.fill(BLACK)
 
-        pygame.display.update()
-        input_key = check_input()
-        if input_key == K_UP and direction != [0, 1]: direction = [0, -1]
-        if input_key == K_DOWN and direction != [0, -1]: direction = [0, 1]
-        if input_key == K_LEFT and direction != [1, 0]: direction = [-1, 0]
-        if input_key == K_RIGHT and direction != [-1, 0]: direction = [1, 0]
+    # Draw snake
+    for segment in snake:
+        pygame.draw.rect(board, GREEN, (segment[0]*CELL_SIZE, segment[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
 
-        current_time = pygame.time.get_ticks()
-        if current_time - last_move > move_delay:
-            head = [snake[0][0] + direction[0], snake[0][1] + direction[1]]
+    # Draw food
+    pygame.draw.rect(board, RED, (food[0]*CELL_SIZE, food[1]*CELL_SIZE, CELL_SIZE, CELL_SIZE))
+    screen.blit(board, (0, 0))
+    full_update = True
 
-            if head in snake or not (0 <= head[0] < GRID_WIDTH and 0 <= head[1] < GRID_HEIGHT):
-                game_over_screen(score, snake, food)
-                return
+def queue_turn(key):
+    # Check against the last queued turn so two quick turns between moves
+    # both count, and ignore reversing into the snake
+    if key not in TURNS or len(turns) >= TURN_BUFFER:
+        return
+    new = TURNS[key]
+    last = turns[-1] if turns else direction
+    if new == last or new == [-last[0], -last[1]]:
+        return
+    turns.append(new)
 
-            snake.insert(0, head)
-            if head == food:
-                score += 1
-                food = random_food(snake)
-            else:
-                snake.pop()
+def snake_game(elapsed):
+    global direction, food, score, last_move, full_update
+    for key in input_keys:
+        queue_turn(key)
 
-            last_move = current_time
+    changed = []
+    current_time = scene_manager.ticks()
+    if current_time - last_move > move_delay:
+        if turns:
+            direction = turns.popleft()
+        head = (snake[0][0] + direction[0], snake[0][1] + direction[1])
 
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                pygame.mouse.set_visible(True)
-                pygame.quit()
-                sys.exit()
-
-# Main loop
-while True:
-    ready_screen()
-    snake_game()
+        if not (0 <= head[0] < GRID_WIDTH and 0 <= head[1] < GRID_HEIGHT) or occupied[cell_index(*head)]:
+            return GAME_OVER
+
+        snake.appendleft(head)
+        occupy(cell_index(*head))
+        changed.append(head)
+        if head == food:
+            score += 1
+            food = random_food()
+            if food is None:
+                return GAME_OVER
+            changed.append(food)
+        else:
+            tail = snake.pop()
+            vacate(cell_index(*tail))
+            changed.append(tail)
+
+        last_move = current_time
+
+    # Wake for the next move
+    scene_manager.wake_at = (last_move + move_delay + 1) / 1000
+    scene_manager.profiler.mark("sim")
+
+    if scene_manager.scene_frames == 0 or scene_manager.profiler.redraw or (changed and not INCREMENTAL):
+        repaint_board()
+        scene_manager.drawn = True
+    elif changed:
+        for pos in changed:
+            paint_cell(pos)
+        scene_manager.drawn = True
+    if scene_manager.profiler.overlay:
+        # The overlay is drawn over the screen, put the board back under it
+        screen.blit(board, (0, 0))
+        full_update = True
+
+def present():
+    global full_update
+    if full_update:
+        framebuffer.present()
+    else:
+        framebuffer.present(dirty_rects)
+    dirty_rects.clear()
+    full_update = False
+
+def read_input(now):
+    global input_keys
+    input_keys = check_input()
+    if K_F3 in input_keys:
+        scene_manager.profiler.toggle_overlay()
+        input_keys = [key for key in input_keys if key != K_F3]
+
+def game_loop(display=None, controller=None):
+    # Runs until ESC or the window is closed. Without a display this is the
+    # whole program - it opens its own display and controller and shuts
+    # pygame down at the end, the launcher passes in its own instead.
+    global screen, board, font_large, font_huge, font_small, reader, quit_requested
+    standalone = display is None
+    if standalone:
+        pygame.init()
+        display = framebuffer.open_display((800, 600), pygame.FULLSCREEN)
+        pygame.display.set_caption("Snake")
+        pygame.mouse.set_visible(False)
+        if USE_CONTROLLER:
+            controller = open_device(*CONTROLLER_ID)
+    screen = display
+    board = pygame.Surface(screen.get_size())
+    font_large = pygame.font.SysFont('Courier New', 48, bold=True)
+    font_huge = pygame.font.SysFont('Courier New', 96, bold=True)
+    font_small = pygame.font.SysFont('Courier New', 28, bold=True)
+    quit_requested = False
+
+    scene_manager.add(READY, ready_screen)
+    scene_manager.add(PLAYING, snake_game, enter=new_game)
+    scene_manager.add(GAME_OVER, game_over_screen, enter=record_score, duration=GAME_OVER_TIME, next_scene=READY)
+    session.start("snake")
+    high_scores.start()
+    reader = HIDReader(controller, decode_report) if controller else None
+    if reader:
+        reader.start()
+    scene_manager.run(READY, frame=read_input, present=present)
+    if reader:
+        reader.stop()
+    high_scores.stop()
+
+    if standalone:
+        pygame.mouse.set_visible(True)
+        framebuffer.close_display()
+        pygame.quit()
+
+if __name__ == "__main__":
+    game_loop()
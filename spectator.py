@@ -0,0 +1,189 @@
+import socket
+import struct
+import sys
+
+# Spectator broadcast for pong. The game publishes compact binary snapshots
+# over UDP (multicast or unicast, e.g. localhost). Every KEYFRAME_INTERVAL
+# packets a keyframe carries the whole state, in between a delta carries only
+# the fields that differ from the last keyframe. Sends never block - if the
+# socket is not ready the snapshot is dropped and counted.
+#
+# Run "python spectator.py 239.255.42.99:5005" for a scoreboard screen.
+
+MAGIC = 0xB0
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_INTERVAL = 30
+HEADER = struct.Struct("<BBHH")  # magic, kind, seq, keyframe seq
+
+# (name, format, scale) - floats are sent as scaled integers
+FIELDS = [
+    ("ball_x", "h", 4),
+    ("ball_y", "h", 4),
+    ("ball_dx", "h", 100),
+    ("ball_dy", "h", 100),
+    ("p1_pos", "h", 4),
+    ("p2_pos", "h", 4),
+    ("p1_score", "B", 1),
+    ("p2_score", "B", 1),
+    ("game_state", "B", 1),
+]
+FIELD_STRUCTS = [struct.Struct("<" + fmt) for _, fmt, _ in FIELDS]
+KEYFRAME_DATA = struct.Struct("<" + "".join(fmt for _, fmt, _ in FIELDS))
+MASK = struct.Struct("<H")
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def is_multicast(host):
+    return 224 <= int(host.split(".")[0]) <= 239
+
+
+def encode_state(state):
+    # state is a tuple in FIELDS order
+    return tuple(int(round(value * scale)) for value, (_, _, scale) in zip(state, FIELDS))
+
+
+def decode_state(values):
+    return tuple(value / scale if scale != 1 else value for value, (_, _, scale) in zip(values, FIELDS))
+
+
+class Broadcaster:
+    def __init__(self, address, rate=30, ttl=1):
+        self.address = parse_address(address)
+        self.interval = 1.0 / rate
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        if is_multicast(self.address[0]):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.seq = 0
+        self.keyframe_seq = 0
+        self.keyframe = None
+        self.next_send = 0.0
+        self.sent = 0
+        self.dropped = 0
+
+    def due(self, now):
+        return now >= self.next_send
+
+    def publish(self, now, state):
+        # Check due() first so the state tuple is only built when needed
+        if now < self.next_send:
+            return
+        self.next_send = max(self.next_send + self.interval, now)
+        values = encode_state(state)
+
+        if self.keyframe is None or (self.seq - self.keyframe_seq) & 0xFFFF >= KEYFRAME_INTERVAL:
+            self.keyframe = values
+            self.keyframe_seq = self.seq
+            packet = HEADER.pack(MAGIC, KEYFRAME, self.seq, self.seq) + KEYFRAME_DATA.pack(*values)
+        else:
+            mask = 0
+            parts = []
+            for i, value in enumerate(values):
+                if value != self.keyframe[i]:
+                    mask |= 1 << i
+                    parts.append(FIELD_STRUCTS[i].pack(value))
+            packet = HEADER.pack(MAGIC, DELTA, self.seq, self.keyframe_seq) + MASK.pack(mask) + b"".join(parts)
+        self.seq = (self.seq + 1) & 0xFFFF
+
+        try:
+            self.sock.sendto(packet, self.address)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class Receiver:
+    def __init__(self, address):
+        host, port = parse_address(address)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("" if is_multicast(host) else host, port))
+        if is_multicast(host):
+            membership = socket.inet_aton(host) + socket.inet_aton("0.0.0.0")
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.sock.setblocking(False)
+        self.keyframe = None
+        self.keyframe_seq = None
+        self.state = None
+
+    def poll(self):
+        # Apply every waiting packet, returns the latest decoded state or None
+        while True:
+            try:
+                packet = self.sock.recv(512)
+            except (BlockingIOError, InterruptedError):
+                break
+            self.apply(packet)
+        return self.state
+
+    def apply(self, packet):
+        if len(packet) < HEADER.size:
+            return
+        magic, kind, seq, keyframe_seq = HEADER.unpack_from(packet)
+        if magic != MAGIC:
+            return
+        if kind == KEYFRAME:
+            self.keyframe = KEYFRAME_DATA.unpack_from(packet, HEADER.size)
+            self.keyframe_seq = seq
+            self.state = decode_state(self.keyframe)
+            return
+
+        # A delta against a keyframe we never got is useless, wait for the next
+        if keyframe_seq != self.keyframe_seq:
+            return
+        mask, = MASK.unpack_from(packet, HEADER.size)
+        offset = HEADER.size + MASK.size
+        values = list(self.keyframe)
+        for i, field_struct in enumerate(FIELD_STRUCTS):
+            if mask & (1 << i):
+                values[i], = field_struct.unpack_from(packet, offset)
+                offset += field_struct.size
+        self.state = decode_state(values)
+
+
+def run_viewer(address):
+    import pygame
+
+    # Pong's layout
+    width, height = 800, 600
+    paddle_width, paddle_height, ball_size = 20, 100, 20
+    white, black = (255, 255, 255), (25, 0, 50)
+
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("BikePong spectator")
+    font = pygame.font.Font(None, 48)
+    clock = pygame.time.Clock()
+    receiver = Receiver(address)
+
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                running = False
+
+        state = receiver.poll()
+        screen.fill(black)
+        if state:
+            ball_x, ball_y, _, _, p1_pos, p2_pos, p1_score, p2_score, _ = state
+            pygame.draw.rect(screen, white, (50, p1_pos, paddle_width, paddle_height))
+            pygame.draw.rect(screen, white, (width - 50 - paddle_width, p2_pos, paddle_width, paddle_height))
+            pygame.draw.ellipse(screen, white, (ball_x, ball_y, ball_size, ball_size))
+            text = font.render(f"{p1_score} - {p2_score}", True, white)
+            screen.blit(text, text.get_rect(center=(width // 2, 50)))
+        pygame.display.flip()
+        clock.tick(60)
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    run_viewer(sys.argv[1] if len(sys.argv) > 1 else "239.255.42.99:5005")
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Buffered event log. log() only appends a record to a bounded in-memory
+# buffer - when the buffer is full the record is dropped and counted, so a
+# caller can never block on logging. A background thread writes the records
+# out in batches as JSON lines to a size-rotated file.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+class EventLog:
+    def __init__(self, path, level=INFO, capacity=4096, batch_size=256,
+                 flush_interval=0.5, max_bytes=1000000, backups=3):
+        self.path = path
+        self.level = level
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = deque()
+        self.dropped = 0
+        self.written = 0
+        self.file = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.stopping = False
+
+    def log(self, level, event, **fields):
+        if level < self.level:
+            return
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        self.records.append((time.time(), level, event, fields))
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def start(self):
+        if self.thread:
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="event-log", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        self.file = open(self.path, "a")
+        try:
+            while not self.stopping:
+                self.wake.wait(self.flush_interval)
+                self.wake.clear()
+                self.flush()
+            self.flush()
+        finally:
+            self.file.close()
+            self.file = None
+
+    def flush(self):
+        while self.records:
+            lines = []
+            while self.records and len(lines) < self.batch_size:
+                timestamp, level, event, fields = self.records.popleft()
+                record = {"time": round(timestamp, 6), "level": LEVEL_NAMES.get(level, level), "event": event}
+                record.update(fields)
+                lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+            self.file.write("".join(lines))
+            self.file.flush()
+            self.written += len(lines)
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a")
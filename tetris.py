@@ -1,30 +1,35 @@
 import pygame
-import sys
 import random
-import hid  # hidapi
 from pygame.locals import *
+from scenes import SceneManager
+from replay import session
+from profiler import FrameProfiler
+from hid_input import HIDReader, open_device
+from tetris_board import Board, build_piece
+from timers import Timers
+from tetris_bot import Autoplayer
+from highscores import HighScores
+import framebuffer
 
 # Configuration
 USE_CONTROLLER = True
 
-# Initialize Pygame
-pygame.init()
-
 # Playfield dimensions (fixed 10x20 blocks)
 WIDTH, HEIGHT = 300, 600
 BLOCK_SIZE = 30
-screen = pygame.display.set_mode((800, 600), pygame.FULLSCREEN)
-pygame.display.set_caption("Tetris")
-pygame.mouse.set_visible(False)
+COLUMNS = WIDTH // BLOCK_SIZE
+ROWS = HEIGHT // BLOCK_SIZE
 
-# Offset to center playfield
-offset_x = (screen.get_width() - WIDTH) // 2
-offset_y = (screen.get_height() - HEIGHT) // 2
+# Display - set up by game_loop, the playfield is centred on it
+screen = None
+offset_x = 0
+offset_y = 0
 
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (25, 0, 50)
 DIM_BLOCK_COLOR = (50, 50, 50)
+GRAY = (120, 120, 120)
 COLORS = [
     (255, 0, 0),
     (0, 255, 0),
@@ -34,10 +39,11 @@ COLORS = [
     (255, 0, 255)
 ]
 
-# Fonts (blocky, LED-friendly)
-font_huge = pygame.font.SysFont('', 200, bold=False)
-font_large = pygame.font.SysFont('', 96, bold=False)
-font_small = pygame.font.SysFont('', 72, bold=False)
+# Fonts (blocky, LED-friendly) - loaded by game_loop
+font_huge = None
+font_large = None
+font_small = None
+font_scores = None
 
 # Tetrimino shapes
 SHAPES = [
@@ -49,221 +55,479 @@ SHAPES = [
     [[1, 1, 1], [1, 0, 0]],
     [[1, 1, 1], [0, 0, 1]]
 ]
+# All four orientations and the rotation kicks, built once
+PIECES = [build_piece(shape) for shape in SHAPES]
+
+# Game states
+READY = 0
+PLAYING = 1
+GAME_OVER = 2
+ATTRACT = 3
+GAME_OVER_TIME = 5
+
+# High scores - kept across runs, the best few are shown on the ready
+# screen. Attract mode games never get to GAME_OVER so aren't recorded.
+HIGH_SCORE_FILE = "high_scores.db"
+SHOWN_SCORES = 5
+high_scores = HighScores(HIGH_SCORE_FILE, "tetris")
+score_rank = None
+
+# Attract mode - after ATTRACT_DELAY s on the ready screen the bot plays
+# until any input. Lookahead plays better but costs a lot more per piece.
+ATTRACT_DELAY = 20
+BOT_MOVE_TIME = 120  # ms between bot moves
+BOT_LOOKAHEAD = False
+
+# Timing (ms) - gravity, auto-repeat, lock delay and speed-ups all run off
+# one set of timers, and the loop sleeps until the next one is due
+START_DROP_TIME = 500
+MIN_DROP_TIME = 200
+DROP_TIME_STEP = 30
+speed_increase_interval = 5000
+DAS = 170  # held direction starts repeating after this
+ARR = 50  # then repeats this often
+LOCK_DELAY = 500  # a landed piece locks after this
+MAX_LOCK_RESETS = 15  # moves that restart the lock delay, per piece
+PACED = True
+
+# Rendering - the locked stack is kept on its own surface and only
+# re-rendered when it changes, while PLAYING a frame just restores the cells
+# under the old piece and blits the piece's block sprites
+DIRTY_RECTS = True
+
+# Frame profiling - F3 toggles the overlay, stats are written on exit
+PROFILE = False
+PROFILE_FILE = "tetris_profile.json"
+scene_manager = SceneManager(fps=60, profiler=FrameProfiler(enabled=PROFILE, export_path=PROFILE_FILE), paced=PACED)
+input_keys = []
 
 score = 0
-grid = [[0 for _ in range(WIDTH // BLOCK_SIZE)] for _ in range(HEIGHT // BLOCK_SIZE)]
-
-if USE_CONTROLLER:
-    try:
-        controller = hid.device()
-        controller.open(0x0810, 0xe501)
-        controller.set_nonblocking(True)
-        controller_connected = True
-    except Exception as e:
-        controller_connected = False
-        print("Controller not connected.", e)
-else:
-    controller_connected = False
+board = Board(COLUMNS, ROWS)
+stack_surface = None
+playfield_rect = None
+stack_changed = True
+tetrimino = None
+piece_changed = False
+drop_time = START_DROP_TIME
+timers = Timers()
+shift_direction = 0
+lock_resets = 0
+bot = Autoplayer(PIECES, COLUMNS, ROWS, lookahead=BOT_LOOKAHEAD)
+bot_piece = None
+bot_target = None
+
+# Controller reports
+KEY_MAP = {
+    (1, 128, 128, 127, 127, 47,  0, 0): K_a,
+    (1, 128, 128, 127, 127, 31,  0, 0): K_b,
+    (1, 128, 128, 127,   0, 15,  0, 0): K_UP,
+    (1, 128, 128, 127, 255, 15,  0, 0): K_DOWN,
+    (1, 128, 128,   0, 127, 15,  0, 0): K_LEFT,
+    (1, 128, 128, 255, 127, 15,  0, 0): K_RIGHT,
+    (1, 128, 128, 127, 127, 15, 32, 0): K_SPACE,
+    (1, 128, 128, 127, 127, 15, 16, 0): K_RETURN
+}
+NEUTRAL_REPORT = (1, 128, 128, 127, 127, 15, 0, 0)
+RELEASE = 0
+
+SHIFT_KEYS = {-1: K_LEFT, 1: K_RIGHT}
+HELD_KEYS = (K_LEFT, K_RIGHT)
+
+def decode_report(data):
+    report = tuple(data[:8])
+    if report == NEUTRAL_REPORT:
+        return RELEASE
+    return KEY_MAP.get(report)
+
+# Controller - reports are read on a background thread while a game runs
+CONTROLLER_ID = (0x0810, 0xe501)
+reader = None
+
+# Set when the window was closed rather than the game left with ESC
+quit_requested = False
+
+def stop(quit=False):
+    global quit_requested
+    quit_requested = quit
+    scene_manager.stop()
 
 def draw_text(text, font, color, surface, x, y):
     text_obj = font.render(text, True, color)
     text_rect = text_obj.get_rect(center=(x, y))
     surface.blit(text_obj, text_rect)
 
-last_input_time = {}
+hid_held = None
 
 def check_input():
-    key_map = {
-        (1, 128, 128, 127, 127, 47,  0, 0): K_a,
-        (1, 128, 128, 127, 127, 31,  0, 0): K_b,
-        (1, 128, 128, 127,   0, 15,  0, 0): K_UP,
-        (1, 128, 128, 127, 255, 15,  0, 0): K_DOWN,
-        (1, 128, 128,   0, 127, 15,  0, 0): K_LEFT,
-        (1, 128, 128, 255, 127, 15,  0, 0): K_RIGHT,
-        (1, 128, 128, 127, 127, 15, 32, 0): K_SPACE,
-        (1, 128, 128, 127, 127, 15, 16, 0): K_RETURN
-    }
+    # Every key pressed since the last frame, in order
+    global hid_held
+    keys = []
     try:
-        for event in pygame.event.get():
+        for event in session.events():
             if event.type == QUIT:
-                pygame.mouse.set_visible(True)
-                pygame.quit()
-                sys.exit()
+                stop(quit=True)
             if event.type == KEYDOWN:
                 if event.key == K_ESCAPE:
-                    pygame.mouse.set_visible(True)
-                    pygame.quit()
-                    sys.exit()
-                return event.key
+                    stop()
+                keys.append(event.key)
     except Exception as e:
         print("Event error:", e)
         pygame.event.clear()
-
-    if controller_connected:
-        current_time = pygame.time.get_ticks()
-        debounce_delay = 150  # ms
-        while True:
-            input_data = tuple(controller.read(64))
-            if not input_data:
-                break
-            if input_data in key_map:
-                key = key_map[input_data]
-                if key not in last_input_time or current_time - last_input_time[key] > debounce_delay:
-                    last_input_time[key] = current_time
-                    return key
-                return key_map[input_data]
-    return None
+    scene_manager.profiler.mark("events")
+
+    # The controller repeats its report while a button is held, only a
+    # change counts as a press
+    for timestamp, key in session.hid_events(reader.drain() if reader else []):
+        if key == RELEASE:
+            hid_held = None
+        elif key != hid_held:
+            hid_held = key
+            keys.append(key)
+    return keys
+
+def held_keys():
+    held = session.pressed(HELD_KEYS)
+    if hid_held in HELD_KEYS:
+        held = held | {hid_held}
+    return held
+
+def orientation(tetrimino):
+    return tetrimino['piece'].orientations[tetrimino['rotation']]
 
 def rotate_tetrimino(tetrimino):
-    return list(zip(*reversed(tetrimino['shape'])))
+    # Rotate clockwise at the first kick offset that fits, False if none do
+    piece = tetrimino['piece']
+    rotation = tetrimino['rotation']
+    masks = piece.orientations[(rotation + 1) % 4].masks
+    for dx, dy in piece.kicks[rotation]:
+        if not board.collides(masks, tetrimino['x'] + dx, tetrimino['y'] + dy):
+            tetrimino['rotation'] = (rotation + 1) % 4
+            tetrimino['x'] += dx
+            tetrimino['y'] += dy
+            return True
+    return False
 
 def create_tetrimino():
-    shape = random.choice(SHAPES)
+    piece = random.choice(PIECES)
     color = random.choice(COLORS)
-    x = WIDTH // BLOCK_SIZE // 2 - len(shape[0]) // 2
+    x = COLUMNS // 2 - piece.orientations[0].width // 2
     y = 0
-    return {'shape': shape, 'color': color, 'x': x, 'y': y}
-
-def draw_grid():
-    for y, row in enumerate(grid):
+    return {'piece': piece, 'rotation': 0, 'color': color, 'x': x, 'y': y}
+
+def make_block_sprite(color):
+    # In the screen's format, which is the framebuffer's rather than the
+    # display's when drawing to one
+    sprite = pygame.Surface((BLOCK_SIZE, BLOCK_SIZE)).convert(screen)
+    sprite.fill(color)
+    pygame.draw.rect(sprite, BLACK, (0, 0, BLOCK_SIZE, BLOCK_SIZE), 1)
+    return sprite
+
+# One pre-rendered block per colour, made by game_loop
+BLOCK_SPRITES = {}
+
+# Cells drawn under the piece last frame, and this frame's dirty rects
+piece_rects = []
+dirty_rects = []
+dirty = False
+
+def render_stack():
+    global stack_changed
+    stack_surface.fill(BLACK)
+    for y, row in enumerate(board.colors):
         for x, cell in enumerate(row):
             if cell:
-                pygame.draw.rect(screen, cell,
-                                 (offset_x + x * BLOCK_SIZE, offset_y + y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE))
-                pygame.draw.rect(screen, BLACK,
-                                 (offset_x + x * BLOCK_SIZE, offset_y + y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE), 1)
+                stack_surface.blit(BLOCK_SPRITES[cell], (x * BLOCK_SIZE, y * BLOCK_SIZE))
+    stack_changed = False
 
 def draw_tetrimino(tetrimino):
-    for y, row in enumerate(tetrimino['shape']):
-        for x, cell in enumerate(row):
-            if cell:
-                pygame.draw.rect(screen, tetrimino['color'],
-                    (offset_x + (tetrimino['x'] + x) * BLOCK_SIZE,
-                     offset_y + (tetrimino['y'] + y) * BLOCK_SIZE,
-                     BLOCK_SIZE, BLOCK_SIZE))
-                pygame.draw.rect(screen, BLACK,
-                    (offset_x + (tetrimino['x'] + x) * BLOCK_SIZE,
-                     offset_y + (tetrimino['y'] + y) * BLOCK_SIZE,
-                     BLOCK_SIZE, BLOCK_SIZE), 1)
-
-def is_collision(tetrimino, dx, dy, rotated_shape=None):
-    shape = rotated_shape if rotated_shape else tetrimino['shape']
-    for y, row in enumerate(shape):
-        for x, cell in enumerate(row):
-            if cell:
-                new_x = tetrimino['x'] + x + dx
-                new_y = tetrimino['y'] + y + dy
-                if new_x < 0 or new_x >= WIDTH // BLOCK_SIZE or new_y >= HEIGHT // BLOCK_SIZE or (new_y >= 0 and grid[new_y][new_x]):
-                    return True
-    return False
+    # Returns the screen rects it drew
+    sprite = BLOCK_SPRITES[tetrimino['color']]
+    left = offset_x + tetrimino['x'] * BLOCK_SIZE
+    top = offset_y + tetrimino['y'] * BLOCK_SIZE
+    return [screen.blit(sprite, (left + x * BLOCK_SIZE, top + y * BLOCK_SIZE))
+            for x, y in orientation(tetrimino).cells]
+
+def is_collision(tetrimino, dx, dy):
+    return board.collides(orientation(tetrimino).masks, tetrimino['x'] + dx, tetrimino['y'] + dy)
 
 def lock_tetrimino(tetrimino):
-    for y, row in enumerate(tetrimino['shape']):
-        for x, cell in enumerate(row):
-            if cell:
-                grid[tetrimino['y'] + y][tetrimino['x'] + x] = tetrimino['color']
+    global stack_changed
+    stack_changed = True
+    return board.lock(orientation(tetrimino).masks, tetrimino['x'], tetrimino['y'], tetrimino['color'])
 
 def clear_lines():
-    global score
-    full_lines = [y for y, row in enumerate(grid) if all(row)]
-    for y in full_lines:
-        del grid[y]
-        grid.insert(0, [0 for _ in range(WIDTH // BLOCK_SIZE)])
-    score += len(full_lines) * 10
-
-def game_over_screen(final_score):
-    for y, row in enumerate(grid):
+    global score, stack_changed
+    cleared = board.clear_lines()
+    if cleared:
+        score += cleared * 10
+        stack_changed = True
+
+def game_over_screen(elapsed):
+    redraw = scene_manager.profiler.redraw
+    if scene_manager.scene_frames and not redraw:
+        return
+    scene_manager.drawn = True
+    if redraw:
+        # The overlay was over the last playfield frame, start from nothing
+        screen.fill(BLACK)
+        pygame.draw.rect(screen, WHITE, (offset_x - 2, offset_y - 2, WIDTH + 4, HEIGHT + 4), 2)
+    for y, row in enumerate(board.colors):
         for x, cell in enumerate(row):
             if cell:
                 pygame.draw.rect(screen, DIM_BLOCK_COLOR, (offset_x + x * BLOCK_SIZE, offset_y + y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE))
-    draw_text(f"{final_score}", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
-    pygame.display.update()
-    pygame.time.wait(5000)
-
-def ready_screen():
-    screen.fill(BLACK)
-    draw_text("Ready?", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
-    pygame.display.update()
-    while True:
-        input_key = check_input()
-        if input_key == K_SPACE:
-            break
-        pygame.time.wait(100)
+    draw_text(f"{score}", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
+    if score_rank:
+        draw_text(f"High score #{score_rank}", font_scores, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2 + 80)
+
+def record_score():
+    # Replays (and the benchmarks) don't go on the table
+    global score_rank
+    score_rank = None if session.replaying else high_scores.add(score)
+
+def draw_high_scores(y):
+    for i, (best, _, _) in enumerate(high_scores.top(SHOWN_SCORES)):
+        draw_text(f"{i + 1}. {best}", font_scores, GRAY, screen, screen.get_width() // 2, y + i * 36)
 
-def tetris_game():
-    global score, grid
-    grid = [[0 for _ in range(WIDTH // BLOCK_SIZE)] for _ in range(HEIGHT // BLOCK_SIZE)]
+def ready_screen(elapsed):
+    if scene_manager.scene_frames == 0 or scene_manager.profiler.redraw:
+        screen.fill(BLACK)
+        draw_text("Ready?", font_large, WHITE, screen, screen.get_width() // 2, screen.get_height() // 2)
+        draw_high_scores(screen.get_height() // 2 + 80)
+        scene_manager.drawn = True
+    if K_SPACE in input_keys:
+        return PLAYING
+    if input_keys:
+        scene_manager.started = scene_manager.now
+    elif elapsed >= ATTRACT_DELAY:
+        return ATTRACT
+    scene_manager.wake_at = scene_manager.started + ATTRACT_DELAY
+
+def new_game():
+    global score, tetrimino, drop_time, stack_changed, shift_direction, lock_resets
+    board.clear()
+    stack_changed = True
     score = 0
     tetrimino = create_tetrimino()
-    drop_time = 500
-    last_drop = pygame.time.get_ticks()
-    last_move_time = {"left": 0, "right": 0, "down": 0, "up": 0}
-    move_delay = 150
-    speed_increase_interval = 5000
-    last_speed_increase = pygame.time.get_ticks()
+    drop_time = START_DROP_TIME
+    shift_direction = 0
+    lock_resets = 0
+    now = scene_manager.ticks()
+    timers.clear()
+    timers.set("gravity", now + drop_time)
+    timers.set("speed_up", now + speed_increase_interval)
+
+def piece_moved(now):
+    # A move or rotation of a landed piece restarts its lock delay, a few times
+    global piece_changed, lock_resets
+    piece_changed = True
+    if timers.pending("lock") and lock_resets < MAX_LOCK_RESETS:
+        lock_resets += 1
+        timers.set("lock", now + LOCK_DELAY)
+
+def shift_tetrimino(dx, now):
+    if not is_collision(tetrimino, dx, 0):
+        tetrimino['x'] += dx
+        piece_moved(now)
+
+def lock_and_spawn():
+    # False when the piece locked partly above the top (a kick can lift it
+    # there) or the new piece has no room
+    global tetrimino, lock_resets
+    if not lock_tetrimino(tetrimino):
+        return False
+    clear_lines()
+    tetrimino = create_tetrimino()
+    lock_resets = 0
+    return not is_collision(tetrimino, 0, 0)
+
+def run_timer(name, due, now):
+    global drop_time, piece_changed
+    if name == "shift":
+        shift_tetrimino(shift_direction, now)
+        timers.set("shift", due + ARR)
+    elif name == "gravity":
+        if not is_collision(tetrimino, 0, 1):
+            tetrimino['y'] += 1
+            piece_changed = True
+        timers.set("gravity", due + drop_time)
+    elif name == "lock":
+        # It may have been moved off the ledge since
+        if is_collision(tetrimino, 0, 1):
+            piece_changed = True
+            return lock_and_spawn()
+    elif name == "speed_up":
+        if drop_time > MIN_DROP_TIME:
+            drop_time -= DROP_TIME_STEP
+        timers.set("speed_up", due + speed_increase_interval)
+    elif name == "bot":
+        bot_move(now)
+        timers.set("bot", due + BOT_MOVE_TIME)
+    return True
+
+def press(key, now):
+    global shift_direction, piece_changed
+    if key in (K_LEFT, K_RIGHT):
+        shift_direction = -1 if key == K_LEFT else 1
+        shift_tetrimino(shift_direction, now)
+        timers.set("shift", now + DAS)
+
+    if key == K_UP:
+        if rotate_tetrimino(tetrimino):
+            piece_moved(now)
+
+    # Use DOWN for hard drop (traditional Tetris control)
+    if key == K_DOWN:
+        distance = board.drop_distance(orientation(tetrimino).masks, tetrimino['x'], tetrimino['y'])
+        if distance:
+            tetrimino['y'] += distance
+            piece_changed = True
+
+def tetris_game(elapsed):
+    global shift_direction, piece_changed
+    current_time = scene_manager.ticks()
+
+    for input_key in input_keys:
+        press(input_key, current_time)
+
+    # Auto-repeat stops when the direction is let go
+    if shift_direction and SHIFT_KEYS[shift_direction] not in held_keys():
+        shift_direction = 0
+        timers.cancel("shift")
 
     while True:
+        timer = timers.pop_due(current_time)
+        if timer is None:
+            break
+        name, due = timer
+        if not run_timer(name, due, current_time):
+            return GAME_OVER
+
+    if is_collision(tetrimino, 0, 1) and not timers.pending("lock"):
+        timers.set("lock", current_time + LOCK_DELAY)
+
+    # Wake for the next timer
+    scene_manager.wake_at = (timers.next_deadline() + 1) / 1000
+    scene_manager.profiler.mark("sim")
+    profiler = scene_manager.profiler
+    if piece_changed or stack_changed or scene_manager.scene_frames == 0 or profiler.overlay or profiler.redraw:
+        draw_playfield()
+        piece_changed = False
+        scene_manager.drawn = True
+
+def bot_move(now):
+    # One step towards the bot's placement for the current piece - rotate,
+    # then shift, then drop. Drop early if the way is blocked.
+    global bot_piece, bot_target
+    if bot_piece is not tetrimino:
+        bot_piece = tetrimino
+        bot_target = bot.choose(board.rows, tetrimino['piece'])
+    rotation, x = bot_target
+    if tetrimino['rotation'] != rotation:
+        if rotate_tetrimino(tetrimino):
+            piece_moved(now)
+            return
+    elif tetrimino['x'] != x:
+        dx = 1 if x > tetrimino['x'] else -1
+        if not is_collision(tetrimino, dx, 0):
+            shift_tetrimino(dx, now)
+            return
+    press(K_DOWN, now)
+
+def start_attract():
+    new_game()
+    timers.set("bot", scene_manager.ticks() + BOT_MOVE_TIME)
+
+def attract_screen(elapsed):
+    # Any real input ends it, start goes straight into a game
+    if input_keys:
+        return PLAYING if K_SPACE in input_keys else READY
+    if tetris_game(elapsed) == GAME_OVER:
+        return READY
+
+def draw_playfield():
+    global piece_rects, dirty
+    # The score only changes with the stack, so a full redraw covers it. So
+    # does a piece sticking out over the border above the playfield.
+    full = (stack_changed or not DIRTY_RECTS or scene_manager.scene_frames == 0
+            or scene_manager.profiler.overlay or scene_manager.profiler.redraw or tetrimino['y'] < 0
+            or not all(playfield_rect.contains(rect) for rect in piece_rects))
+    if stack_changed:
+        render_stack()
+    if full:
         screen.fill(BLACK)
         pygame.draw.rect(screen, WHITE, (offset_x - 2, offset_y - 2, WIDTH + 4, HEIGHT + 4), 2)
-
-        draw_grid()
-        draw_tetrimino(tetrimino)
+        screen.blit(stack_surface, (offset_x, offset_y))
         draw_text(f"{score}", font_small, WHITE, screen, offset_x + WIDTH + 60, offset_y + 30)
-        pygame.display.update()
-
-        input_key = check_input()
-        current_time = pygame.time.get_ticks()
-
-        if input_key == K_LEFT and not is_collision(tetrimino, -1, 0):
-            if current_time - last_move_time["left"] > move_delay:
-                tetrimino['x'] -= 1
-                last_move_time["left"] = current_time
-
-        if input_key == K_RIGHT and not is_collision(tetrimino, 1, 0):
-            if current_time - last_move_time["right"] > move_delay:
-                tetrimino['x'] += 1
-                last_move_time["right"] = current_time
-
-        # Removed soft drop from DOWN key since it now does hard drop
-        pass
-
-        if input_key == K_UP:
-            if current_time - last_move_time["up"] > 200:  # Only debounce rotation
-                rotated_shape = rotate_tetrimino(tetrimino)
-                if not is_collision(tetrimino, 0, 0, rotated_shape):
-                    tetrimino['shape'] = rotated_shape
-                    last_move_time["up"] = current_time
-
-        # Use DOWN for hard drop (traditional Tetris control)
-        if input_key == K_DOWN:
-            if current_time - last_move_time["down"] > 500:  # Debounce hard drop
-                while not is_collision(tetrimino, 0, 1):
-                    tetrimino['y'] += 1
-                last_move_time["down"] = current_time
-
-        if current_time - last_drop > drop_time:
-            if not is_collision(tetrimino, 0, 1):
-                tetrimino['y'] += 1
-            else:
-                lock_tetrimino(tetrimino)
-                clear_lines()
-                tetrimino = create_tetrimino()
-                if is_collision(tetrimino, 0, 0):
-                    game_over_screen(score)
-                    return
-            last_drop = current_time
-
-        if current_time - last_speed_increase > speed_increase_interval:
-            if drop_time > 200:
-                drop_time -= 30
-            last_speed_increase = current_time
-
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                pygame.mouse.set_visible(True)
-                pygame.quit()
-                sys.exit()
-
-while True:
-    ready_screen()
-    tetris_game()
+    else:
+        for rect in piece_rects:
+            screen.blit(stack_surface, rect, rect.move(-offset_x, -offset_y))
+        dirty_rects.extend(piece_rects)
+    piece_rects = draw_tetrimino(tetrimino)
+    dirty_rects.extend(piece_rects)
+    dirty = not full
+
+def present():
+    global dirty
+    if dirty:
+        framebuffer.present(dirty_rects)
+    else:
+        framebuffer.present()
+    dirty_rects.clear()
+    dirty = False
+
+def read_input(now):
+    global input_keys
+    input_keys = check_input()
+    if K_F3 in input_keys:
+        scene_manager.profiler.toggle_overlay()
+        input_keys = [key for key in input_keys if key != K_F3]
+
+def game_loop(display=None, controller=None):
+    # Runs until ESC or the window is closed. Without a display this is the
+    # whole program - it opens its own display and controller and shuts
+    # pygame down at the end, the launcher passes in its own instead.
+    global screen, offset_x, offset_y, font_huge, font_large, font_small, font_scores
+    global stack_surface, playfield_rect, stack_changed, hid_held, reader, quit_requested
+    standalone = display is None
+    if standalone:
+        pygame.init()
+        display = framebuffer.open_display((800, 600), pygame.FULLSCREEN)
+        pygame.display.set_caption("Tetris")
+        pygame.mouse.set_visible(False)
+        if USE_CONTROLLER:
+            controller = open_device(*CONTROLLER_ID)
+    screen = display
+    offset_x = (screen.get_width() - WIDTH) // 2
+    offset_y = (screen.get_height() - HEIGHT) // 2
+    font_huge = pygame.font.SysFont('', 200, bold=False)
+    font_large = pygame.font.SysFont('', 96, bold=False)
+    font_small = pygame.font.SysFont('', 72, bold=False)
+    font_scores = pygame.font.SysFont('', 40, bold=False)
+    BLOCK_SPRITES.update((color, make_block_sprite(color)) for color in COLORS)
+    stack_surface = pygame.Surface((WIDTH, HEIGHT))
+    playfield_rect = pygame.Rect(offset_x, offset_y, WIDTH, HEIGHT)
+    stack_changed = True
+    hid_held = None
+    quit_requested = False
+
+    scene_manager.add(READY, ready_screen)
+    scene_manager.add(PLAYING, tetris_game, enter=new_game)
+    scene_manager.add(GAME_OVER, game_over_screen, enter=record_score, duration=GAME_OVER_TIME, next_scene=READY)
+    scene_manager.add(ATTRACT, attract_screen, enter=start_attract)
+    session.start("tetris")
+    high_scores.start()
+    reader = HIDReader(controller, decode_report) if controller else None
+    if reader:
+        reader.start()
+    scene_manager.run(READY, frame=read_input, present=present)
+    if reader:
+        reader.stop()
+    high_scores.stop()
+
+    if standalone:
+        pygame.mouse.set_visible(True)
+        framebuffer.close_display()
+        pygame.quit()
+
+if __name__ == "__main__":
+    game_loop()
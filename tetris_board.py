@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+# Bitboard playfield for tetris. Occupancy is one int per row with bit x set
+# for column x, colours are kept separately for drawing. Pieces are given as
+# row masks (see shape_masks), so a collision test is a shift and an AND per
+# piece row and a full line is a compare against the full row mask.
+#
+# Every piece's four orientations are built once up front, together with
+# the offsets to try when rotating out of each one, so a rotation is an
+# index change plus a few collision tests.
+
+# Kicks tried in order after a rotation, (dx, dy) on top of the offset that
+# keeps the piece centred. Pieces four cells long get the wider set.
+KICKS = ((0, 0), (-1, 0), (1, 0))
+LONG_KICKS = ((0, 0), (-1, 0), (1, 0), (-2, 0), (2, 0))
+
+# cells are (x, y) offsets from the top left of the width x height box
+Orientation = namedtuple("Orientation", "cells masks width height")
+# kicks[r] are the offsets to try rotating clockwise out of orientation r
+Piece = namedtuple("Piece", "orientations kicks")
+
+
+def shape_masks(shape):
+    # Row masks of a shape given as rows of 0/1 cells
+    return tuple(sum(1 << x for x, cell in enumerate(row) if cell) for row in shape)
+
+
+def build_piece(shape):
+    orientations = []
+    for _ in range(4):
+        cells = tuple((x, y) for y, row in enumerate(shape) for x, cell in enumerate(row) if cell)
+        orientations.append(Orientation(cells, shape_masks(shape), len(shape[0]), len(shape)))
+        shape = [list(row) for row in zip(*reversed(shape))]
+
+    kicks = []
+    for rotation, current in enumerate(orientations):
+        # Half the change in size keeps the centre in place, rounded down one
+        # way and up the other so four rotations come back to the start
+        diff = current.width - current.height
+        if rotation % 2 == 0:
+            dx, dy = diff // 2, -diff // 2
+        else:
+            dx, dy = -(-diff // 2), -(diff // 2)
+        table = LONG_KICKS if max(current.width, current.height) >= 4 else KICKS
+        kicks.append(tuple((dx + kx, dy + ky) for kx, ky in table))
+    return Piece(tuple(orientations), tuple(kicks))
+
+
+class Board:
+    def __init__(self, columns=10, rows=20):
+        self.columns = columns
+        self.row_count = rows
+        self.full = (1 << columns) - 1
+        self.clear()
+
+    def clear(self):
+        self.rows = [0] * self.row_count
+        self.colors = [[0] * self.columns for _ in range(self.row_count)]
+
+    def collides(self, masks, x, y):
+        # Rows above the top are open, the sides and the floor are not
+        if x < 0:
+            return True
+        rows = self.rows
+        for i, mask in enumerate(masks):
+            if not mask:
+                continue
+            mask <<= x
+            row = y + i
+            if mask > self.full or row >= self.row_count or (row >= 0 and rows[row] & mask):
+                return True
+        return False
+
+    def drop_distance(self, masks, x, y):
+        # How far the piece falls before it lands - each piece row scans down
+        # for the first row it would hit, no further than the best so far
+        rows = self.rows
+        distance = self.row_count
+        for i, mask in enumerate(masks):
+            if not mask:
+                continue
+            mask <<= x
+            row = y + i + 1
+            limit = min(self.row_count, row + distance)
+            while row < limit and not (row >= 0 and rows[row] & mask):
+                row += 1
+            distance = row - (y + i) - 1
+        return distance
+
+    def lock(self, masks, x, y, color):
+        # False when part of the piece is above the top and was left out
+        fits = True
+        for i, mask in enumerate(masks):
+            row = y + i
+            if not mask:
+                continue
+            if row < 0:
+                fits = False
+                continue
+            mask <<= x
+            self.rows[row] |= mask
+            colors = self.colors[row]
+            column = x
+            mask >>= x
+            while mask:
+                if mask & 1:
+                    colors[column] = color
+                mask >>= 1
+                column += 1
+        return fits
+
+    def clear_lines(self):
+        # Drop full rows and add empty ones on top, returns how many cleared
+        full = self.full
+        keep = [i for i, row in enumerate(self.rows) if row != full]
+        cleared = self.row_count - len(keep)
+        if cleared:
+            self.rows = [0] * cleared + [self.rows[i] for i in keep]
+            self.colors = [[0] * self.columns for _ in range(cleared)] + [self.colors[i] for i in keep]
+        return cleared
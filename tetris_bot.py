@@ -0,0 +1,97 @@
+import numpy as np
+
+# Tetris autoplayer for the attract mode. For the current piece every
+# distinct rotation in every column is dropped straight down onto the stack
+# and the resulting boards are scored together in NumPy - lines cleared,
+# aggregate height, holes and bumpiness. With lookahead each of those boards
+# is also scored by its best placement of every possible next piece,
+# averaged, as the game has no preview.
+
+# Feature weights from the usual hand tuned evaluator
+LINES_WEIGHT = 0.76
+HEIGHT_WEIGHT = -0.51
+HOLES_WEIGHT = -0.36
+BUMPINESS_WEIGHT = -0.18
+
+
+class Placements:
+    # Every distinct (rotation, x) of one piece, with the board cells of each
+    # as column and row offsets from the landing row
+    def __init__(self, piece, columns):
+        seen = set()
+        moves, cell_columns, cell_rows = [], [], []
+        for rotation, orientation in enumerate(piece.orientations):
+            if orientation.cells in seen:
+                continue
+            seen.add(orientation.cells)
+            for x in range(columns - orientation.width + 1):
+                moves.append((rotation, x))
+                cell_columns.append([x + cx for cx, cy in orientation.cells])
+                cell_rows.append([cy for cx, cy in orientation.cells])
+        self.moves = moves
+        self.columns = np.array(cell_columns)
+        self.rows = np.array(cell_rows)
+
+
+class Autoplayer:
+    def __init__(self, pieces, columns, rows, lookahead=False):
+        self.columns = columns
+        self.rows = rows
+        self.lookahead = lookahead
+        self.placements = {piece: Placements(piece, columns) for piece in pieces}
+
+    def board_array(self, row_masks):
+        masks = np.array(row_masks)
+        return ((masks[:, None] >> np.arange(self.columns)) & 1).astype(bool)
+
+    def drop(self, boards, placements):
+        # boards (B, rows, columns) -> every board with every placement
+        # (B * P, ...), plus lines cleared and whether the piece fit
+        count = len(boards)
+        filled = boards.any(axis=1)
+        top = np.where(filled, boards.argmax(axis=1), self.rows)
+        # The piece lands where its lowest cell in some column meets the top
+        landing = (top[:, placements.columns] - placements.rows - 1).min(axis=2)
+        cell_rows = landing[:, :, None] + placements.rows
+        valid = cell_rows.min(axis=2) >= 0
+
+        moves = len(placements.moves)
+        result = np.repeat(boards, moves, axis=0)
+        board_index = np.repeat(np.arange(count * moves), placements.rows.shape[1])
+        result[board_index, np.maximum(cell_rows, 0).ravel(),
+               np.tile(placements.columns, (count, 1, 1)).ravel()] = True
+
+        # Clear full rows - sort them to the top as empty rows
+        full = result.all(axis=2)
+        lines = full.sum(axis=1)
+        if lines.any():
+            result[full] = False
+            order = np.argsort(np.where(full, -1, np.arange(self.rows)), axis=1, kind="stable")
+            result = np.take_along_axis(result, order[:, :, None], axis=1)
+        return result, lines, valid.ravel()
+
+    def score(self, boards, lines):
+        filled = boards.any(axis=1)
+        heights = np.where(filled, self.rows - boards.argmax(axis=1), 0)
+        covered = np.logical_or.accumulate(boards, axis=1)
+        holes = (covered & ~boards).sum(axis=(1, 2))
+        bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+        return (LINES_WEIGHT * lines + HEIGHT_WEIGHT * heights.sum(axis=1)
+                + HOLES_WEIGHT * holes + BUMPINESS_WEIGHT * bumpiness)
+
+    def choose(self, row_masks, piece):
+        # Best (rotation, x) for piece on a board given as row masks
+        placements = self.placements[piece]
+        boards, lines, valid = self.drop(self.board_array(row_masks)[None], placements)
+        if self.lookahead:
+            scores = np.zeros(len(boards))
+            for next_placements in self.placements.values():
+                after, next_lines, next_valid = self.drop(boards, next_placements)
+                next_scores = self.score(after, lines.repeat(len(next_placements.moves)) + next_lines)
+                next_scores[~next_valid] = -np.inf
+                scores += next_scores.reshape(len(boards), -1).max(axis=1)
+            scores /= len(self.placements)
+        else:
+            scores = self.score(boards, lines)
+        scores[~valid] = -np.inf
+        return placements.moves[int(np.argmax(scores))]
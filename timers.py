@@ -0,0 +1,42 @@
+import heapq
+
+# Deadline scheduler for game timers. Each named timer has at most one
+# pending deadline - setting it again moves it, and stale heap entries are
+# skipped when they come up. The game pops due timers once per frame and can
+# sleep until next_deadline() in between.
+
+
+class Timers:
+    def __init__(self):
+        self.deadlines = {}
+        self.heap = []
+
+    def set(self, name, due):
+        self.deadlines[name] = due
+        heapq.heappush(self.heap, (due, name))
+
+    def cancel(self, name):
+        self.deadlines.pop(name, None)
+
+    def pending(self, name):
+        return name in self.deadlines
+
+    def clear(self):
+        self.deadlines.clear()
+        self.heap.clear()
+
+    def next_deadline(self):
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now):
+        # The earliest (name, due) timer due by now, or None. A handler that
+        # re-arms from due rather than now keeps a repeating timer on its beat.
+        due = self.next_deadline()
+        if due is None or due > now:
+            return None
+        _, name = heapq.heappop(self.heap)
+        del self.deadlines[name]
+        return name, due